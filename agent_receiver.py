@@ -0,0 +1,110 @@
+#receives details pushed by metrics_agent.py and keeps the snapshot store up to date
+#hosts that push are skipped by the collector, and fall back to ssh if they stop pushing
+
+import socket
+import threading
+import time
+import logging
+
+import metrics
+from metrics_agent import parse_datagram, DEFAULT_PORT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = '0.0.0.0'
+
+#biggest datagram accepted, pushes are a few hundred bytes
+MAX_DATAGRAM_SIZE = 65535
+
+DATAGRAMS = metrics.counter('agent_datagrams_total', 'Datagrams received from metrics agents, by result', ['result'])
+
+class AgentReceiver:
+    def __init__(self, servers, convert, store, timeout, port=DEFAULT_PORT, address=DEFAULT_ADDRESS, key=None, history=None, breaker=None):
+        #convert is called as convert(host, ip, values) and returns the details for the host
+        #a host counts as pushing for timeout seconds after its last accepted push
+        self.hosts = {server['host'] for server in servers}
+        self.convert = convert
+        self.store = store
+        self.timeout = timeout
+        self.port = port
+        self.address = address
+        self.key = key
+        self.history = history
+        #a push means the host is back, so it stops counting as degraded from earlier ssh failures
+        self.breaker = breaker
+
+        #host -> (agent time of the last accepted push, monotonic time it was received)
+        self.last_push = {}
+        self.lock = threading.Lock()
+        self.sock = None
+        self.thread = None
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((self.address, self.port))
+        logging.info(f'Listening for metrics agents on {self.address}:{self.port}...')
+
+        self.thread = threading.Thread(target=self.__run, name='agent-receiver', daemon=True)
+        self.thread.start()
+
+    def is_pushing(self, host):
+        #true if the host's agent pushed recently, so there's no need to grab its details over ssh
+        with self.lock:
+            last_push = self.last_push.get(host)
+        return last_push is not None and time.monotonic() - last_push[1] < self.timeout
+
+    def __receive(self, datagram, ip):
+        try:
+            message = parse_datagram(datagram, self.key)
+        except ValueError as e:
+            logging.warning(f'Dropping datagram from {ip}: {e}')
+            DATAGRAMS.inc(result='invalid')
+            return
+
+        host = message['host']
+        if host not in self.hosts:
+            logging.warning(f'Dropping datagram from {ip} for unknown host {host}')
+            DATAGRAMS.inc(result='unknown_host')
+            return
+
+        #udp can arrive out of order or twice, only take pushes newer than the last one
+        #the time is the agent's clock, so once nothing newer was accepted for the timeout (ex: a pi without an rtc synced back,
+        #or the last push was from the future) it starts over instead of dropping every push until the clock catches up
+        #while pushes are still coming in, older ones are never taken, so old signed datagrams can't be replayed
+        with self.lock:
+            last_push = self.last_push.get(host)
+            if last_push is not None and message['time'] <= last_push[0]:
+                if time.monotonic() - last_push[1] < self.timeout:
+                    DATAGRAMS.inc(result='old')
+                    return
+                logging.info(f'Clock for host {host} went back {last_push[0] - message["time"]:.0f} seconds, taking its pushes from now on.')
+                DATAGRAMS.inc(result='clock_reset')
+
+        try:
+            details = self.convert(host, ip, message['values'])
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f'Dropping datagram from {ip} for host {host} with bad values: {e}')
+            DATAGRAMS.inc(result='invalid')
+            return
+
+        with self.lock:
+            if host not in self.last_push:
+                logging.info(f'Host {host} is pushing its details from {ip}, no longer grabbing them over ssh.')
+            self.last_push[host] = (message['time'], time.monotonic())
+
+        self.store.update(host, details)
+        if self.history is not None:
+            self.history.record(host, details)
+        if self.breaker is not None:
+            self.breaker.record_success(host)
+        DATAGRAMS.inc(result='accepted')
+        logging.debug(f'Host {host} pushed details: {details}')
+
+    def __run(self):
+        while True:
+            try:
+                datagram, (ip, _) = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+            except OSError:
+                #the socket is gone, ex: the process is shutting down
+                return
+            self.__receive(datagram, ip)
@@ -0,0 +1,34 @@
+#micro benchmark for converting a page image into the panel's buffer with EPD.getbuffer
+#compares the old rotate, convert and copy into a new bytearray against the fast path
+#run from the repository root with: python -m benchmarks.frame_buffer
+
+import os
+import timeit
+from PIL import Image, ImageDraw
+
+#no panel is needed, so use the simulated one unless told otherwise
+os.environ.setdefault('EPD_BACKEND', 'simulated')
+os.environ.setdefault('EPD_SIMULATED_TIME_SCALE', '0')
+
+from epd_text import IMAGE_MODE, IMAGE_SIZE, BACKGROUND_COLOR
+from waveshare_epd import epd2in13_V4
+
+ITERATIONS = 2000
+
+def legacy_getbuffer(image):
+    #how the buffer used to be made
+    return bytearray(image.rotate(90, expand=True).convert('1').tobytes('raw'))
+
+def run(name, getbuffer, image):
+    seconds = timeit.timeit(lambda: getbuffer(image), number=ITERATIONS)
+    print(f'{name:<10} {seconds / ITERATIONS * 1000000:8.1f} us/frame')
+
+if __name__ == '__main__':
+    image = Image.new(IMAGE_MODE, IMAGE_SIZE, BACKGROUND_COLOR)
+    ImageDraw.Draw(image).text((10, 10), 'FRAME BUFFER BENCHMARK')
+
+    epd = epd2in13_V4.EPD()
+    assert bytes(legacy_getbuffer(image)) == bytes(epd.getbuffer(image))
+
+    run('before', legacy_getbuffer, image)
+    run('after', epd.getbuffer, image)
@@ -0,0 +1,156 @@
+#end to end benchmark for one full rotation: grabbing every host's details, showing every host page, and the overview page
+#hosts are fake, commands are answered by a fake executor with injected latency and failures, and the panel is simulated
+#run from the repository root with: python -m benchmarks.rotation_cycle [--hosts 1,10,50,200] [--cycles 5] ...
+
+import os
+import re
+import logging
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+#the panel has to be picked before the display modules are imported
+os.environ.setdefault('EPD_BACKEND', 'simulated')
+os.environ.setdefault('EPD_SIMULATED_TIME_SCALE', '0')
+
+import display
+import raspberry_pi_system_information_commands as RSYSINFO
+from epd_text import epd_text
+from cache_file import CacheFile
+from host_resolver import HostResolver
+from poll_schedule import PollSchedule
+
+#what the fake hosts answer for each command
+FAKE_VALUES = {
+    'MODEL': 'Raspberry Pi Zero 2 W Rev 1.0',
+    'OPERATING_SYSTEM': 'Debian GNU/Linux 12 (bookworm)',
+    'CPU_MODEL': 'Cortex-A53',
+    'ARCHITECTURE': 'aarch64',
+    'MEMORY': '427',
+    'CPU_TEMPERATURE': lambda: str(random.randint(38000, 55000)),
+    'CPU_LOAD': lambda: f'{random.uniform(0, 100):.1f}',
+    'USED_MEMORY_PERCENTAGE': lambda: f'{random.uniform(10, 90):g}',
+    'BOOT_ID': 'a5b1c3d4-0000-0000-0000-000000000000',
+}
+
+def percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return 0
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+def make_fake_executor(latency, jitter, failure_rate):
+    def get_shell_return(command, ssh=False, ssh_user=None, ssh_host=None, ssh_key=None, deadline=None):
+        time.sleep(max(0, random.gauss(latency, jitter)))
+        if random.random() < failure_rate:
+            raise subprocess.CalledProcessError(255, command)
+
+        lines = []
+        for name in re.findall(re.escape(RSYSINFO.BATCH_MARKER) + r'(\w+)', command):
+            value = FAKE_VALUES[name]
+            lines += [f'{RSYSINFO.BATCH_MARKER}{name}', value() if callable(value) else value]
+        return '\n'.join(lines)
+
+    return get_shell_return
+
+def set_up(host_count, args):
+    servers = [{'host': f'bench-host-{i}', 'user': 'pi'} for i in range(host_count)]
+
+    display.CONFIG = {
+        'display_title': '--Benchmark Server Status--',
+        'line_count': 6,
+        'display_time': 0,
+        'ssh_key': 'unused',
+        'command_timeout': 10,
+        'host_timeout': 30,
+        'collection_workers': args.workers,
+    }
+    display.SERVERS = servers
+    display.SERVER_COUNT = host_count
+    display.CACHE = CacheFile(f'benchmark-{host_count}')
+    display.SCHEDULE = PollSchedule(display.DEFAULT_POLL_INTERVALS)
+    display.RESOLVER = HostResolver(overrides={server['host']: f'10.0.{i // 250}.{i % 250 + 1}' for i, server in enumerate(servers)})
+    display.get_shell_return = make_fake_executor(args.latency, args.jitter, args.failure_rate)
+
+    return servers
+
+def run_cycle(panel, servers, executor, timings):
+    cycle_start = time.perf_counter()
+
+    #grab every host at once, like the collector does
+    def collect(server):
+        start = time.perf_counter()
+        try:
+            details = display.get_server_details(server['host'], server['user'])
+        except subprocess.CalledProcessError:
+            #injected failure, shown as offline like the collector does
+            details = {'host': server['host'], 'accessible': False}
+            timings['failures'] += 1
+        timings['collect host'].append(time.perf_counter() - start)
+        return details
+
+    start = time.perf_counter()
+    all_details = list(executor.map(collect, servers))
+    timings['collect all'].append(time.perf_counter() - start)
+
+    accessible = 0
+    temperatures = []
+    cpu_loads = []
+    memory_usage = []
+    for i, details in enumerate(all_details):
+        if details['accessible']:
+            accessible += 1
+            temperatures.append(float(details['cpu_temp']))
+            cpu_loads.append(float(details['cpu_load']))
+            memory_usage.append(float(details['used_memory']))
+
+        start = time.perf_counter()
+        display.display_server_details(panel, details, index=i)
+        timings['host page'].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    display.display_overview_page(panel, len(servers), accessible, temperatures, cpu_loads, memory_usage)
+    timings['overview page'].append(time.perf_counter() - start)
+
+    timings['cycle'].append(time.perf_counter() - cycle_start)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a full rotation cycle against fake hosts and a simulated panel.')
+    parser.add_argument('--hosts', default='1,10,50,200', help='comma separated host counts to run')
+    parser.add_argument('--cycles', type=int, default=5, help='cycles to run for each host count')
+    parser.add_argument('--workers', type=int, default=8, help='hosts to grab at the same time')
+    parser.add_argument('--latency', type=float, default=0.05, help='average seconds for a fake host to answer')
+    parser.add_argument('--jitter', type=float, default=0.02, help='standard deviation of the fake latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='chance of a fake command failing, 0 to 1')
+    parser.add_argument('--partial', action='store_true', help='use partial refresh mode')
+    args = parser.parse_args()
+
+    #keep the benchmark's cache files out of the real cache
+    os.chdir(tempfile.mkdtemp(prefix='rotation-benchmark-'))
+    logging.basicConfig(level=logging.WARNING)
+
+    panel = epd_text(6, margin_x=1, margin_y=1, partial_refresh=args.partial)
+
+    print(f"{'hosts':>6} {'stage':<14} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for host_count in [int(count) for count in args.hosts.split(',')]:
+        servers = set_up(host_count, args)
+        timings = {'collect host': [], 'collect all': [], 'host page': [], 'overview page': [], 'cycle': [], 'failures': 0}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(args.workers, host_count))) as executor:
+            for _ in range(args.cycles):
+                run_cycle(panel, servers, executor, timings)
+
+        failures = timings.pop('failures')
+        for stage, values in timings.items():
+            print(f'{host_count:>6} {stage:<14} ' + ' '.join(f'{percentile(values, p) * 1000:>10.2f}' for p in (50, 90, 99)) + f' {max(values) * 1000:>10.2f}')
+
+        print(f'{host_count:>6} injected failures: {failures}')
+
+    print(f'skipped refreshes: {panel.skipped_refreshes}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#micro benchmark for laying out text with epd_text.set_line_text
+#compares the old way (measuring text on a new full size image and drawing every line),
+#cached measurements, and cached measurements with cached rendered text
+#run from the repository root with: python -m benchmarks.text_layout [font_file] [font_size]
+
+import sys
+import os
+import timeit
+from PIL import Image, ImageDraw, ImageFont
+
+#no panel is needed, so use the simulated one unless told otherwise
+os.environ.setdefault('EPD_BACKEND', 'simulated')
+os.environ.setdefault('EPD_SIMULATED_TIME_SCALE', '0')
+
+import epd_text as epd_text_module
+from epd_text import epd_text, loadLinePositions, IMAGE_MODE, IMAGE_SIZE, BACKGROUND_COLOR
+
+ITERATIONS = 200
+LINE_COUNT = 6
+
+#a typical host page
+PAGE = [
+    ('--Seddon Server Status--', {'center': True}),
+    ('3 / 8', {'right_justify': True}),
+    ('rpi02w-2 (192.168.4.231)', {'center': True}),
+    ('Raspberry Pi Zero 2 W Rev 1.0', {'center': True}),
+    ('Debian GNU/Linux 12 (bookworm)', {'center': True}),
+    ('CPU: Cortex-A53 (aarch64),  4.5%,  41°C', {'center': True}),
+    ('Memory: 427MB,  38%', {'center': True}),
+]
+
+def legacy_get_text_size(text, font=None):
+    #how text used to be measured, on a new full size image every time
+    image = Image.new(IMAGE_MODE, IMAGE_SIZE, BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(image)
+    _, _, w, h = draw.textbbox((0, 0), text, font=font)
+    return w, h
+
+def legacy_draw_text(display, position, text):
+    #how text used to be drawn, rendering the glyphs every time
+    display.image_draw.text(position, text, font=display.font)
+
+def make_display(font):
+    #only the layout is benchmarked, so the panel set up in __init__ is skipped
+    display = epd_text.__new__(epd_text)
+    display.line_positions, display.line_size = loadLinePositions(LINE_COUNT)
+    display.line_count = len(display.line_positions)
+    display.margin_x = 1
+    display.font = font
+    return display
+
+def render_page(display):
+    display.new_image()
+    line = 0
+    for text, options in PAGE:
+        display.set_line_text(min(line, LINE_COUNT - 1), text, **options)
+        if 'right_justify' not in options:
+            line += 1
+
+def run(name, display):
+    seconds = timeit.timeit(lambda: render_page(display), number=ITERATIONS)
+    per_call = seconds / (ITERATIONS * len(PAGE)) * 1000000
+    print(f'{name:<10} {seconds / ITERATIONS * 1000:8.3f} ms/page  {per_call:8.1f} us/set_line_text')
+
+if __name__ == '__main__':
+    font = ImageFont.truetype(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 13) if len(sys.argv) > 1 else None
+    display = make_display(font)
+
+    cached_get_text_size = epd_text_module.get_text_size
+    epd_text_module.get_text_size = legacy_get_text_size
+    display.draw_text = lambda position, text: legacy_draw_text(display, position, text)
+    run('before', display)
+
+    epd_text_module.get_text_size = cached_get_text_size
+    run('measured', display)
+
+    del display.draw_text
+    run('tiled', display)
@@ -1,14 +1,41 @@
 #very simple module for easily managing simple key/value json files
+#the file is loaded into memory once, and changes are written back in the background
 
 import os
 import json
 import logging
+import threading
+import atexit
+import time
+
+import metrics
 
 logger = logging.getLogger(__name__)
 
+#how long to wait after a change before writing the file, so several changes get written at once
+DEFAULT_FLUSH_DELAY = 5
+
+#expiry times for keys with a ttl are kept in the file under this key
+EXPIRY_KEY = '__expiry__'
+
+LOOKUPS = metrics.counter('cache_lookups_total', 'Cache file lookups, by cache file and result', ['file', 'result'])
+
 class CacheFile:
-    def __init__(self, file='cache'):
+    def __init__(self, file='cache', flush_delay=DEFAULT_FLUSH_DELAY):
         self.file = file
+        self.flush_delay = flush_delay
+
+        #the cache can be used from multiple collection threads at once
+        self.lock = threading.RLock()
+        self.flush_timer = None
+        self.dirty = False
+
+        self.path = self.__getCachePath()
+        self.cache = self.__getCacheJSONDictionary()
+        self.expiry = self.cache.pop(EXPIRY_KEY, {})
+
+        #make sure pending changes are saved when the program exits
+        atexit.register(self.flush)
 
     def __getCachePath(self):
         #builds the cache file path
@@ -16,19 +43,17 @@ class CacheFile:
         if not os.path.isdir(path):
             logging.info(f'Creating cache folder [{path}]...')
             os.makedirs(path)
-        
+
         path = os.path.join(path, f'{self.file}.json')
         return path
-    
+
     def getFilePath(self):
-        return self.__getCachePath()
+        return self.path
 
     def __getCacheJSONDictionary(self):
         #returns the cache json file as a dictionary
-        path = self.__getCachePath()
-
-        if os.path.exists(path):
-            with open(path, 'r+') as f:
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
                 cache = json.load(f)
         else:
             cache = {}
@@ -37,10 +62,15 @@ class CacheFile:
 
     def __saveCacheFile(self, cache):
         #updates the cache file
-        path = self.__getCachePath()
+        #write to a temporary file first and swap it in, so a crash never leaves a half written file
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f'{self.path}.tmp'
 
-        with open(path, 'w') as f:
+        with open(temp_path, 'w') as f:
             json.dump(cache, f, indent = 4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
 
     def __is_serializable(value):
         try:
@@ -48,24 +78,69 @@ class CacheFile:
             return True
         except(TypeError, OverflowError):
             return False
-        
-    def setValue(self, key, value):
-        #saves a value to the cache file
-        cache = self.__getCacheJSONDictionary()
 
+    def __scheduleFlush(self):
+        #must be called with the lock held
+        self.dirty = True
+        if self.flush_timer is None:
+            self.flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def flush(self):
+        #writes any pending changes to the cache file
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+
+            if not self.dirty:
+                return
+
+            logging.debug(f'Writing cache file [{self.path}]...')
+            cache = dict(self.cache)
+            if self.expiry:
+                cache[EXPIRY_KEY] = self.expiry
+            self.__saveCacheFile(cache)
+            self.dirty = False
+
+    def setValue(self, key, value, ttl=None):
+        #saves a value to the cache
+        #if ttl is given, the value expires after that many seconds
         if not CacheFile.__is_serializable(value):
             value = str(value)
 
-        logging.info(f'Saving cache key [{key}] value [{value}]')
-        cache[key] = value
-        self.__saveCacheFile(cache)
+        with self.lock:
+            logging.info(f'Saving cache key [{key}] value [{value}]')
+            self.cache[key] = value
+            if ttl is None:
+                self.expiry.pop(key, None)
+            else:
+                self.expiry[key] = time.time() + ttl
+            self.__scheduleFlush()
+
+    def deleteValue(self, key):
+        #removes a value from the cache
+        with self.lock:
+            if key in self.cache:
+                logging.info(f'Deleting cache key [{key}]')
+                del self.cache[key]
+                self.expiry.pop(key, None)
+                self.__scheduleFlush()
 
     def getValue(self, key, default=None):
-        #returns a value from the cache file
-        cache = self.__getCacheJSONDictionary()
+        #returns a value from the cache
+        with self.lock:
+            if key in self.expiry and self.expiry[key] <= time.time():
+                logging.info(f'Cache key [{key}] expired')
+                self.deleteValue(key)
+                LOOKUPS.inc(file=self.file, result='expired')
+                return default
 
-        if key in cache.keys():
-            logging.debug(f'Retrieving cache key [{key}] value [{cache[key]}]')
-            return cache[key]
-        else:
-            return default
\ No newline at end of file
+            if key in self.cache:
+                logging.debug(f'Retrieving cache key [{key}] value [{self.cache[key]}]')
+                LOOKUPS.inc(file=self.file, result='hit')
+                return self.cache[key]
+            else:
+                LOOKUPS.inc(file=self.file, result='miss')
+                return default
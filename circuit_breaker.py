@@ -0,0 +1,51 @@
+#keeps track of hosts that keep failing, so they can be skipped for a while instead of holding things up
+#after failure_threshold failures in a row a host is degraded, and only retried after a backoff that doubles with each failure
+
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_BACKOFF = 30
+DEFAULT_MAX_BACKOFF = 600
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        #host -> failures in a row
+        self.failures = {}
+        #host -> monotonic time the host can be tried again
+        self.retry_times = {}
+        self.lock = threading.Lock()
+
+    def get_retry_time(self, host):
+        #returns the monotonic time the host can be tried again
+        with self.lock:
+            return self.retry_times.get(host, 0)
+
+    def is_degraded(self, host):
+        #true while the host is failing, its last details shouldn't be trusted
+        with self.lock:
+            return self.failures.get(host, 0) >= self.failure_threshold
+
+    def record_success(self, host):
+        with self.lock:
+            if self.failures.get(host, 0) >= self.failure_threshold:
+                logging.info(f'Host {host} recovered.')
+            self.failures.pop(host, None)
+            self.retry_times.pop(host, None)
+
+    def record_failure(self, host):
+        with self.lock:
+            failures = self.failures.get(host, 0) + 1
+            self.failures[host] = failures
+
+            if failures >= self.failure_threshold:
+                backoff = min(self.backoff * (2 ** (failures - self.failure_threshold)), self.max_backoff)
+                self.retry_times[host] = time.monotonic() + backoff
+                logging.warning(f'Host {host} failed {failures} times in a row, retrying in {backoff}s.')
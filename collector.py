@@ -0,0 +1,97 @@
+#grabs server details in the background and keeps the snapshot store up to date
+#each host is refreshed on its own schedule, so a slow host only delays itself
+
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+#hosts grabbed at the same time, each one is a thread and an ssh process, so it's kept small for a pi zero
+DEFAULT_WORKERS = 8
+
+COLLECT_SECONDS = metrics.histogram('collect_seconds', 'Time spent grabbing the details for one host, by result', ['result'])
+
+class Collector:
+    def __init__(self, servers, collect, store, interval, workers=DEFAULT_WORKERS, breaker=None, history=None, skip=None):
+        #collect is called as collect(host, user) and returns the details for the host
+        #if a circuit breaker is given, hosts that keep failing are backed off
+        #if a metric history is given, every collection is recorded in it
+        #if skip is given, it's called as skip(host) and hosts it returns true for aren't collected this time, ex: they push their own details
+        self.servers = servers
+        self.collect = collect
+        self.store = store
+        self.interval = interval
+        self.breaker = breaker
+        self.history = history
+        self.skip = skip
+
+        workers = workers or DEFAULT_WORKERS
+        self.workers = max(1, min(workers, len(servers)))
+
+        #host -> monotonic time the host is due to be collected again
+        self.due = {server['host']: 0 for server in servers}
+        self.running = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        logging.info(f'Starting collector for {len(self.servers)} hosts with {self.workers} workers...')
+        self.thread = threading.Thread(target=self.__run, name='collector', daemon=True)
+        self.thread.start()
+
+    def __collectServer(self, server):
+        host = server['host']
+        start = time.monotonic()
+        due = start + self.interval
+        try:
+            details = self.collect(host, server['user'])
+            self.store.update(host, details)
+            if self.history is not None:
+                self.history.record(host, details)
+            elapsed = time.monotonic() - start
+            COLLECT_SECONDS.observe(elapsed, result='ok')
+            logging.info(f'Grabbing data for {host} took {elapsed} seconds.')
+            if self.breaker is not None:
+                self.breaker.record_success(host)
+        except Exception as e:
+            COLLECT_SECONDS.observe(time.monotonic() - start, result='failed')
+            logging.exception(f'Failed to grab data for host {host}: {e}')
+
+            #keep showing the last details we have, or show it as offline if there are none
+            if self.store.get(host) is None:
+                self.store.update(host, {'host': host, 'accessible': False})
+
+            #leave a gap in the history
+            if self.history is not None:
+                self.history.record(host, {'host': host, 'accessible': False})
+
+            if self.breaker is not None:
+                self.breaker.record_failure(host)
+                due = max(due, self.breaker.get_retry_time(host))
+        finally:
+            with self.lock:
+                self.running.discard(host)
+                self.due[host] = due
+
+    def __run(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                now = time.monotonic()
+                with self.lock:
+                    for server in self.servers:
+                        host = server['host']
+                        if host not in self.running and self.due[host] <= now:
+                            if self.skip is not None and self.skip(host):
+                                self.due[host] = now + self.interval
+                                continue
+                            self.running.add(host)
+                            executor.submit(self.__collectServer, server)
+
+                    next_due = min((due for host, due in self.due.items() if host not in self.running), default=now + self.interval)
+
+                #wake up when the next host is due, but check in every so often for hosts that just finished
+                time.sleep(min(max(next_due - now, 0.1), 1))
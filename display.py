@@ -1,26 +1,155 @@
 from epd_text import epd_text
+import epd_text as epd_text_module
+from waveshare_epd import epd2in13_V4
 import logging
 import yaml
 import raspberry_pi_system_information_commands as RSYSINFO
+import local_system_information as LOCALSYSINFO
 import subprocess
+import shlex
 import time
 import socket
 import os
 from cache_file import CacheFile
+from ssh_connection import SSHConnectionPool, SSH_CONNECTION_ERROR
+import ssh_connection
+from host_resolver import HostResolver
+import host_resolver
+from snapshot_store import SnapshotStore
+from collector import Collector
+import collector
+from circuit_breaker import CircuitBreaker
+import circuit_breaker
+from metric_history import MetricHistory, downsample, average_columns
+import metric_history
+from agent_receiver import AgentReceiver
+import agent_receiver
+from snapshot_api import SnapshotAPI
+import snapshot_api
+from poll_schedule import PollSchedule
 import sys
+import signal
+import atexit
+import metrics
 
 CONFIG = None
 DOCKER = None
 SERVER_COUNT = None
 SERVERS = None
 CACHE = None
+SSH_POOL = None
+RESOLVER = None
+STORE = None
+COLLECTOR = None
+BREAKER = None
+HISTORY = None
+RECEIVER = None
+API = None
+SCHEDULE = None
+
+DEFAULT_COMMAND_TIMEOUT = 10
+DEFAULT_HOST_TIMEOUT = 30
+
+#a failed ssh connection is only retried if at least this many seconds are left before the host's deadline
+MIN_RECONNECT_TIME = 2
+DEFAULT_TREND_WINDOW = 3600
+
+#history metric -> (label, unit, graph bottom, graph top) for trend pages
+TREND_GRAPHS = {
+    'cpu_load': ('CPU', '%', 0, 100),
+    'cpu_temp': ('Temp', '°C', 20, 90),
+    'used_memory': ('Mem', '%', 0, 100),
+}
+
+COMMAND_SECONDS = metrics.histogram('command_seconds', 'Time spent running system information commands, by how they were run and how they ended', ['mode', 'result'])
+SSH_RECONNECTS = metrics.counter('ssh_reconnects_total', 'SSH commands retried on a new connection after the connection failed')
+
+#details key -> system information command
+#static details are cached until the host reboots, dynamic details are grabbed when they're due, see DEFAULT_POLL_INTERVALS
+STATIC_DETAILS = {
+    'system': 'MODEL',
+    'operating_system': 'OPERATING_SYSTEM',
+    'cpu_model': 'CPU_MODEL',
+    'architecture': 'ARCHITECTURE',
+    'memory': 'MEMORY',
+}
+DYNAMIC_DETAILS = {
+    'cpu_load': 'CPU_LOAD',
+    'cpu_temp': 'CPU_TEMPERATURE',
+    'used_memory': 'USED_MEMORY_PERCENTAGE',
+}
+
+#dynamic details key -> default seconds between grabs, 0 grabs it every collection
+DEFAULT_POLL_INTERVALS = {
+    'cpu_load': 0,
+    'cpu_temp': 0,
+    'used_memory': 60,
+}
+
+def get_command_timeout(deadline=None):
+    #each command gets command_timeout seconds, or whatever is left before the host's deadline
+    timeout = CONFIG['command_timeout']
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            raise TimeoutError('Ran out of time grabbing data for host.')
+    return timeout
+
+def get_shell_return(command, ssh=False, ssh_user=None, ssh_host=None, ssh_key=None, deadline=None):
+    start = time.perf_counter()
+    result = 'ok'
+    try:
+        return run_shell_command(command, ssh, ssh_user, ssh_host, ssh_key, deadline)
+    except (subprocess.TimeoutExpired, TimeoutError):
+        result = 'timeout'
+        raise
+    except Exception:
+        result = 'error'
+        raise
+    finally:
+        COMMAND_SECONDS.observe(time.perf_counter() - start, mode='ssh' if ssh else 'shell', result=result)
+
+def get_local_values(commands):
+    start = time.perf_counter()
+    result = 'ok'
+    try:
+        return LOCALSYSINFO.get_values(commands)
+    except Exception:
+        result = 'error'
+        raise
+    finally:
+        COMMAND_SECONDS.observe(time.perf_counter() - start, mode='local', result=result)
+
+def run_shell_command(command, ssh=False, ssh_user=None, ssh_host=None, ssh_key=None, deadline=None):
+    if not ssh:
+        logging.info(f'Running shell command: {command}')
+        result = subprocess.check_output(command, shell=True, timeout=get_command_timeout(deadline)).decode().strip()
+        logging.debug(f'Shell command return: {result}')
+        return result
+
+    #reuse the persistent connection for this host
+    #run ssh directly rather than through a shell, so a timeout kills ssh itself
+    SSH_POOL.ensure_connection(ssh_user, ssh_host, deadline)
+    ssh_command = SSH_POOL.build_command(command, ssh_user, ssh_host)
+    logging.info(f'Running shell command: {ssh_command}')
+    try:
+        result = subprocess.check_output(shlex.split(ssh_command), stdin=subprocess.DEVNULL, timeout=get_command_timeout(deadline)).decode().strip()
+    except subprocess.CalledProcessError as e:
+        if e.returncode != SSH_CONNECTION_ERROR:
+            raise
+
+        #not worth reconnecting if the host's time is almost up
+        if deadline is not None and deadline - time.monotonic() < MIN_RECONNECT_TIME:
+            raise
+
+        #the connection failed, so drop it and try once more on a fresh one
+        #everything here counts against the host's deadline
+        logging.warning(f'SSH connection to {ssh_host} failed, reconnecting...')
+        SSH_RECONNECTS.inc()
+        SSH_POOL.disconnect(ssh_user, ssh_host, deadline)
+        SSH_POOL.ensure_connection(ssh_user, ssh_host, deadline)
+        result = subprocess.check_output(shlex.split(ssh_command), stdin=subprocess.DEVNULL, timeout=get_command_timeout(deadline)).decode().strip()
 
-def get_shell_return(command, ssh=False, ssh_user=None, ssh_host=None, ssh_key=None):
-    if ssh:
-        command = f'ssh -o StrictHostKeyChecking=no -i {ssh_key} {ssh_user}@{ssh_host} {command}'
-
-    logging.info(f'Running shell command: {command}')
-    result = subprocess.check_output(command, shell=True).decode().strip()
     logging.debug(f'Shell command return: {result}')
     return result
 
@@ -29,18 +158,11 @@ def get_server_details(host, user):
 
     details = {'host': host}
 
-    ip = None
-    try:
-        ip = socket.gethostbyname(host)
-    except socket.gaierror as e:
-        logging.warning(e)
-    
-    if ip is None:
-        try:
-            ip = socket.gethostbyname(f'{host}.local')
-        except socket.gaierror as e:
-            logging.warning(e)
-    
+    #every host gets a fixed amount of time, so a hung host can't hold up its worker forever
+    deadline = time.monotonic() + CONFIG['host_timeout']
+
+    ip = RESOLVER.resolve(host)
+
     if ip is None:
         accessible = False
         logging.warning(f'Host {host} inaccessible.')
@@ -63,55 +185,87 @@ def get_server_details(host, user):
             ssh_key = os.path.join(os.path.dirname(os.path.realpath(__file__)), CONFIG['ssh_key'])
             logging.info(f'SSH Key File: {ssh_key}')
 
-        temp = CACHE.getValue(f'{host}-system')
-        if temp is None:
-            temp = get_shell_return(RSYSINFO.MODEL, ssh=ssh, ssh_user=user, ssh_host=ip, ssh_key=ssh_key)
-            CACHE.setValue(f'{host}-system', temp)
-        details['system'] = temp
-
-        #operating system
-        temp = CACHE.getValue(f'{host}-operating_system')
-        if temp is None:
-            temp = get_shell_return(RSYSINFO.OPERATING_SYSTEM, ssh=ssh, ssh_user=user, ssh_host=ip, ssh_key=ssh_key)
-            CACHE.setValue(f'{host}-operating_system', temp)
-        details['operating_system'] = temp
-
-        #cpu
-        temp = CACHE.getValue(f'{host}-cpu_model')
-        if temp is None:
-            temp = get_shell_return(RSYSINFO.CPU_MODEL, ssh=ssh, ssh_user=user, ssh_host=ip, ssh_key=ssh_key)
-            CACHE.setValue(f'{host}-cpu_model', temp)
-        details['cpu_model'] = temp
-        
-        #architecture
-        temp = CACHE.getValue(f'{host}-architecture')
-        if temp is None:
-            temp = get_shell_return(RSYSINFO.ARCHITECTURE, ssh=ssh, ssh_user=user, ssh_host=ip, ssh_key=ssh_key)
-            CACHE.setValue(f'{host}-architecture', temp)
-        details['architecture'] = temp
-
-        temp = get_shell_return(RSYSINFO.CPU_LOAD, ssh=ssh, ssh_user=user, ssh_host=ip, ssh_key=ssh_key)
-        details['cpu_load'] = temp
-
-        temp = get_shell_return(RSYSINFO.CPU_TEMPERATURE, ssh=ssh, ssh_user=user, ssh_host=ip, ssh_key=ssh_key)
-        temp = round(int(temp) / 1000)
-        details['cpu_temp'] = temp
-
-        #total memory
-        temp = CACHE.getValue(f'{host}-memory')
-        if temp is None:
-            temp = get_shell_return(RSYSINFO.MEMORY, ssh=ssh, ssh_user=user, ssh_host=ip, ssh_key=ssh_key)
-            CACHE.setValue(f'{host}-memory', temp)
-        details['memory'] = temp
-
-        temp = get_shell_return(RSYSINFO.USED_MEMORY_PERCENTAGE, ssh=ssh, ssh_user=user, ssh_host=ip, ssh_key=ssh_key)
-        temp = round(float(temp))
-        details['used_memory'] = temp
+        #static details rarely change, so only grab the ones that aren't cached yet
+        commands = []
+        for key, command in STATIC_DETAILS.items():
+            temp = CACHE.getValue(f'{host}-{key}')
+            if temp is None:
+                commands.append(command)
+            else:
+                details[key] = temp
+
+        #dynamic details are only grabbed when they're due, the rest reuse the last value grabbed
+        due = SCHEDULE.get_due(host)
+        commands += [DYNAMIC_DETAILS[key] for key in due]
+
+        #the boot id changes every boot, and tells us when the static details might be out of date
+        commands.append('BOOT_ID')
+
+        #grab everything in one round trip, or read it directly if it's local
+        if ssh:
+            temp = get_shell_return(RSYSINFO.build_batch_command(commands), ssh=ssh, ssh_user=user, ssh_host=ip, ssh_key=ssh_key, deadline=deadline)
+            values = RSYSINFO.parse_batch_output(temp)
+        else:
+            values = get_local_values(commands)
+
+        for key, command in STATIC_DETAILS.items():
+            if command in values:
+                CACHE.setValue(f'{host}-{key}', values[command], ttl=CONFIG.get('static_cache_ttl'))
+                details[key] = values[command]
+
+        #if the host rebooted (it may have been reimaged), drop its static details so they get grabbed again next time
+        boot_id = values.get('BOOT_ID')
+        cached_boot_id = CACHE.getValue(f'{host}-boot_id')
+        if boot_id and boot_id != cached_boot_id:
+            if cached_boot_id is not None:
+                logging.info(f'Host {host} rebooted, refreshing static details on next grab.')
+                for key in STATIC_DETAILS.keys():
+                    CACHE.deleteValue(f'{host}-{key}')
+                SCHEDULE.expire(host)
+            CACHE.setValue(f'{host}-boot_id', boot_id)
+
+        grabbed = {}
+        convert_dynamic_details(grabbed, values)
+        SCHEDULE.update(host, grabbed)
+        details.update(SCHEDULE.get_values(host))
 
     logging.debug(f'Host {host} Details: {details}')
     return details
 
-def display_server_details(display, details: dict, index=None):
+def convert_dynamic_details(details, values):
+    #fills in the dynamic details that are in the system information command values
+    if DYNAMIC_DETAILS['cpu_load'] in values:
+        details['cpu_load'] = values[DYNAMIC_DETAILS['cpu_load']]
+    if DYNAMIC_DETAILS['cpu_temp'] in values:
+        details['cpu_temp'] = round(int(values[DYNAMIC_DETAILS['cpu_temp']]) / 1000)
+    if DYNAMIC_DETAILS['used_memory'] in values:
+        details['used_memory'] = round(float(values[DYNAMIC_DETAILS['used_memory']]))
+
+def get_agent_details(host, ip, values):
+    #builds the details for a host from the values its metrics agent pushed
+    #agents send the static details every time, so nothing is cached
+    details = {'host': host, 'ip': ip, 'accessible': True}
+    for key, command in STATIC_DETAILS.items():
+        details[key] = values.get(command, '')
+
+    missing = [command for command in DYNAMIC_DETAILS.values() if command not in values]
+    if missing:
+        raise KeyError(f'missing {missing}')
+    convert_dynamic_details(details, values)
+    return details
+
+def format_age(seconds):
+    #short age for showing how old data is, ex: 45s, 3m, 2h
+    seconds = int(seconds)
+    if seconds < 60:
+        return f'{seconds}s'
+    elif seconds < 3600:
+        return f'{seconds // 60}m'
+    else:
+        return f'{seconds // 3600}h'
+
+def display_server_details(display, details: dict, index=None, age=None):
+    #if age is given, the details are old and the age is shown next to the host
     logging.info(f"Generating display for host: {details['host']}")
 
     #now write the details
@@ -124,10 +278,13 @@ def display_server_details(display, details: dict, index=None):
     if index is not None:
         display.set_line_text(current_line, f'{index + 1} / {SERVER_COUNT}', right_justify=True)
 
-    if not details['accessible']:
+    if details.get('pending'):
+        display.write_text(f"***WAITING FOR HOST {details['host']}***", center=True)
+    elif not details['accessible']:
         display.write_text(f"***HOST {details['host']} OFFLINE***", center=True)
     else:
-        display.set_line_text(current_line := current_line+1, f"{details['host']} ({details['ip']})", center=True)
+        stale = f"  [{format_age(age)} old]" if age is not None else ''
+        display.set_line_text(current_line := current_line+1, f"{details['host']} ({details['ip']}){stale}", center=True)
         display.set_line_text(current_line := current_line+1, f"{details['system']}", center=True)
         display.set_line_text(current_line := current_line+1, f"{details['operating_system']}", center=True)
         display.set_line_text(current_line := current_line+1, f"CPU: {details['cpu_model']} ({details['architecture']}),  {details['cpu_load']}%,  {details['cpu_temp']}°C", center=True)
@@ -136,14 +293,18 @@ def display_server_details(display, details: dict, index=None):
     #now update
     display.update()
 
+def get_average(values):
+    #the summary page and the snapshot api show the same averages, or None if there are no values
+    return round(sum(values) / len(values)) if values else None
+
 def display_overview_page(display, servers, accessible, temperatures: list, cpu_loads: list, memory_usages: list):
     logging.info('Display summary page...')
     display.new_image()
 
     #calculate averages
-    average_temperature = round(sum(temperatures) / len(temperatures))
-    average_cpu_load = round(sum(cpu_loads) / len(cpu_loads))
-    average_memory_usage = round(sum(memory_usages) / len(memory_usages))
+    average_temperature = get_average(temperatures) or 0
+    average_cpu_load = get_average(cpu_loads) or 0
+    average_memory_usage = get_average(memory_usages) or 0
 
     #display
     current_line = -1
@@ -156,6 +317,73 @@ def display_overview_page(display, servers, accessible, temperatures: list, cpu_
 
     display.update()
 
+def is_host_up(host, details, updated):
+    #a host only counts as up if its details are current, the collector keeps the last details of a host that stopped responding
+    if details is None or not details['accessible']:
+        return False
+    if updated is None or time.time() - updated > CONFIG['stale_after']:
+        return False
+    return BREAKER is None or not BREAKER.is_degraded(host)
+
+def get_overview(snapshots: dict):
+    #the summary page numbers from a dictionary of host -> (details, time collected), for the snapshot api
+    accessible = [details for host, (details, updated) in snapshots.items() if is_host_up(host, details, updated)]
+    return {
+        'servers': SERVER_COUNT,
+        'accessible': len(accessible),
+        'average_cpu_load': get_average([float(details['cpu_load']) for details in accessible]),
+        'average_cpu_temp': get_average([float(details['cpu_temp']) for details in accessible]),
+        'average_used_memory': get_average([float(details['used_memory']) for details in accessible]),
+    }
+
+def get_latest_average(series):
+    #average of the newest sample of each series, skipping missing samples, or None if there are none
+    latest = []
+    for _, values in series:
+        for value in reversed(values):
+            if value == value:
+                latest.append(value)
+                break
+    return get_average(latest)
+
+def display_trend_page(display, title, series: dict, index=None):
+    #series is history metric -> list of (times, values), more than one is averaged, ex: the whole rack
+    logging.info(f'Generating trend page for: {title}')
+    display.new_image()
+
+    window = CONFIG['trend_window']
+    end = time.time()
+    start = end - window
+
+    current_line = -1
+    display.set_line_text(current_line := current_line+1, CONFIG['display_title'], center=True)
+    if index is not None:
+        display.set_line_text(current_line, f'{index + 1} / {SERVER_COUNT}', right_justify=True)
+    display.set_line_text(current_line := current_line+1, f'{title} - last {format_age(window)}', center=True)
+
+    #labels with the latest values on the left, graphs on the right
+    labels = {}
+    for metric, (label, unit, _, _) in TREND_GRAPHS.items():
+        latest = get_latest_average(series[metric])
+        labels[metric] = f"{label} {'--' if latest is None else latest}{unit}"
+    graph_left = display.margin_x + max(epd_text_module.get_text_size(label, display.font)[0] for label in labels.values()) + 4
+    graph_right = epd_text_module.DISPLAY_DIMENSIONS['x'] - display.margin_x
+
+    for metric, (_, _, low, high) in TREND_GRAPHS.items():
+        current_line += 1
+        if current_line >= display.line_count:
+            break
+        display.set_line_text(current_line, labels[metric])
+        columns = average_columns([downsample([host_series], start, end, graph_right - graph_left) for host_series in series[metric]])
+        display.draw_sparkline(display.get_line_box(current_line, graph_left, graph_right), columns, low, high)
+
+    #time axis under the graphs
+    if (current_line := current_line+1) < display.line_count:
+        display.set_line_text(current_line, f'-{format_age(window)}', position=graph_left - display.margin_x)
+        display.set_line_text(current_line, 'now', right_justify=True)
+
+    display.update()
+
 def initialization():
     global CONFIG
     global FONT
@@ -172,7 +400,11 @@ def initialization():
 
     CONFIG = yaml.safe_load(open(config_file))
     logging.info(f'Config file: [{config_file}]')
-    logging.debug(f'Config: {CONFIG}') 
+    #the agent key is a secret, so it's left out of the logs
+    redacted = dict(CONFIG)
+    if isinstance(redacted.get('agent'), dict) and 'key' in redacted['agent']:
+        redacted['agent'] = {**redacted['agent'], 'key': '<redacted>'}
+    logging.debug(f'Config: {redacted}') 
 
     #check ssh key
     if 'ssh_key' not in CONFIG:
@@ -185,6 +417,62 @@ def initialization():
         return False
     
     logging.info(f'SSH Key File: {ssh_key}')
+
+    #check ssh multiplexing
+    multiplexing = CONFIG.get('ssh_multiplexing') or {}
+    if not isinstance(multiplexing, dict):
+        logging.error(f'Invalid ssh_multiplexing config: [{multiplexing}]')
+        return False
+    CONFIG['ssh_multiplexing'] = multiplexing
+    logging.info(f'SSH Multiplexing: {multiplexing}')
+
+    #check dns settings
+    dns = CONFIG.get('dns') or {}
+    if not isinstance(dns, dict) or not isinstance(dns.get('overrides') or {}, dict):
+        logging.error(f'Invalid dns config: [{dns}]')
+        return False
+    CONFIG['dns'] = dns
+    logging.info(f'DNS: {dns}')
+
+    #check metrics export
+    metrics_config = CONFIG.get('metrics') or {}
+    if not isinstance(metrics_config, dict):
+        logging.error(f'Invalid metrics config: [{metrics_config}]')
+        return False
+    CONFIG['metrics'] = metrics_config
+    logging.info(f'Metrics: {metrics_config}')
+
+    #check history settings
+    history = CONFIG.get('history') or {}
+    if not isinstance(history, dict):
+        logging.error(f'Invalid history config: [{history}]')
+        return False
+    CONFIG['history'] = history
+    logging.info(f'History: {history}')
+
+    #check metrics agent settings
+    agent = CONFIG.get('agent') or {}
+    if not isinstance(agent, dict):
+        logging.error(f'Invalid agent config: [{agent}]')
+        return False
+    CONFIG['agent'] = agent
+    logging.info(f"Agent: { {key: value for key, value in agent.items() if key != 'key'} }")
+
+    #check snapshot api settings
+    api = CONFIG.get('api') or {}
+    if not isinstance(api, dict):
+        logging.error(f'Invalid api config: [{api}]')
+        return False
+    CONFIG['api'] = api
+    logging.info(f'API: {api}')
+
+    #check poll intervals
+    poll_intervals = CONFIG.get('poll_intervals') or {}
+    if not isinstance(poll_intervals, dict) or any(key not in DEFAULT_POLL_INTERVALS for key in poll_intervals.keys()):
+        logging.error(f'Invalid poll_intervals config: [{poll_intervals}], valid keys are {list(DEFAULT_POLL_INTERVALS.keys())}')
+        return False
+    CONFIG['poll_intervals'] = {**DEFAULT_POLL_INTERVALS, **poll_intervals}
+    logging.info(f"Poll Intervals: {CONFIG['poll_intervals']}")
     
     #load font
     if CONFIG.get('font_file'):
@@ -196,54 +484,86 @@ def initialization():
 
     return True
 
+def wait_until(deadline):
+    #sleeps until the deadline, returns the deadline to schedule the next page from
+    wait_time = round(deadline - time.monotonic(), 2)
+    if wait_time > 0:
+        logging.info('Wating - ' + str(wait_time) + 's')
+        time.sleep(wait_time)
+        return deadline
+
+    #running behind, so start the next page from now rather than rushing to catch up
+    logging.warning(f'Page ran {-wait_time}s over its display time.')
+    return time.monotonic()
+
 def process_loop():
     #initialize display
-    display = epd_text(CONFIG['line_count'], margin_x=1, margin_y=1, font_file=CONFIG.get('full_font_file'), font_size=CONFIG.get('font_size'))
+    display = epd_text(
+        CONFIG['line_count'], margin_x=1, margin_y=1, font_file=CONFIG.get('full_font_file'), font_size=CONFIG.get('font_size'),
+        partial_refresh=CONFIG.get('partial_refresh', False), full_refresh_interval=CONFIG.get('full_refresh_interval') or epd_text_module.DEFAULT_FULL_REFRESH_INTERVAL,
+        spi_speed_hz=CONFIG.get('spi_speed_hz'), busy_timeout=CONFIG.get('busy_timeout') or epd2in13_V4.DEFAULT_BUSY_TIMEOUT
+    )
+
+    #give the collector a chance to grab everything before the first page
+    if not STORE.wait_for([server['host'] for server in SERVERS], timeout=CONFIG['collection_interval']):
+        logging.warning('Not all hosts returned data in time, starting anyway.')
 
     #process loop
-    first_run = True
+    #pages flip on a fixed schedule using whatever the collector has at the time
+    deadline = time.monotonic()
     while True:
         logging.info('Starting process loop...')
-        
+
         accessible = 0
         temperatures = []
         cpu_loads = []
         memory_usage = []
         for i in range(SERVER_COUNT):
-            #grab data
-            wait_time = time.time()
-            details = get_server_details(SERVERS[i]['host'], SERVERS[i]['user'])
-            wait_time = time.time() - wait_time
-            logging.info(f'Grabbing data took {wait_time} seconds.')
-
-            #save results for use on summary page
-            if details['accessible']:
+            details = STORE.get(SERVERS[i]['host'])
+            if details is None:
+                details = {'host': SERVERS[i]['host'], 'accessible': False, 'pending': True}
+
+            #mark details that haven't been refreshed in a while, ex: the host stopped responding
+            age = None
+            updated = STORE.get_updated(SERVERS[i]['host'])
+            if updated is not None and time.time() - updated > CONFIG['stale_after']:
+                age = time.time() - updated
+
+            #save results for use on summary page, hosts that stopped responding don't count
+            if is_host_up(SERVERS[i]['host'], details, updated):
                 accessible += 1
                 temperatures.append(float(details['cpu_temp']))
                 cpu_loads.append(float(details['cpu_load']))
                 memory_usage.append(float(details['used_memory']))
 
-            #if there is time left, wait for it
-            if not first_run:
-                wait_time = round(CONFIG['display_time'] - wait_time, 2)
-                if wait_time > 0:
-                    logging.info('Wating - ' + str(wait_time) + 's')
-                    time.sleep(wait_time)
-            first_run = False
-
             #display
-            display_server_details(display, details, index=i)
-        
-        logging.info('Wating - ' + str(CONFIG['display_time']) + 's')
-        time.sleep(CONFIG['display_time'])
+            display_server_details(display, details, index=i, age=age)
+            deadline = wait_until(deadline + CONFIG['display_time'])
+
+            if CONFIG['trend_pages']:
+                since = time.time() - CONFIG['trend_window']
+                display_trend_page(display, SERVERS[i]['host'], {metric: [HISTORY.get(SERVERS[i]['host'], metric, since)] for metric in TREND_GRAPHS.keys()}, index=i)
+                deadline = wait_until(deadline + CONFIG['display_time'])
 
         #now that we're done with the loop, print an overview page
         display_overview_page(display, SERVER_COUNT, accessible, temperatures, cpu_loads, memory_usage)
+        deadline = wait_until(deadline + CONFIG['display_time'])
+
+        #and the whole rack's trends
+        if CONFIG['trend_pages']:
+            since = time.time() - CONFIG['trend_window']
+            display_trend_page(display, 'Rack', {metric: [HISTORY.get(server['host'], metric, since) for server in SERVERS] for metric in TREND_GRAPHS.keys()})
+            deadline = wait_until(deadline + CONFIG['display_time'])
+
+        logging.info(f'Unchanged pages skipped so far: {display.skipped_refreshes}')
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     logging.info('Process starting...')
 
+    #exit cleanly when docker stops the container, so pending cache changes get saved
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     valid = initialization()
     if not valid:
         logging.error('Failed to initialize. Exiting...')
@@ -254,11 +574,88 @@ if __name__ == '__main__':
     logging.debug(f'Server Count: {SERVER_COUNT}')
     logging.debug(f'Servers: {SERVERS}')
     logging.debug('Display Time: ' + str(CONFIG['display_time']))
+    CONFIG['collection_interval'] = CONFIG.get('collection_interval') or CONFIG['display_time']
+    logging.debug('Collection Interval: ' + str(CONFIG['collection_interval']))
+    CONFIG['command_timeout'] = CONFIG.get('command_timeout') or DEFAULT_COMMAND_TIMEOUT
+    CONFIG['host_timeout'] = CONFIG.get('host_timeout') or DEFAULT_HOST_TIMEOUT
+    CONFIG['stale_after'] = CONFIG.get('stale_after') or (2 * CONFIG['collection_interval'])
+    CONFIG['trend_pages'] = CONFIG.get('trend_pages', False)
+    CONFIG['trend_window'] = CONFIG.get('trend_window') or DEFAULT_TREND_WINDOW
+    logging.debug(f"Trend Pages: {CONFIG['trend_pages']}, Trend Window: {CONFIG['trend_window']}")
+    logging.debug(f"Command Timeout: {CONFIG['command_timeout']}, Host Timeout: {CONFIG['host_timeout']}, Stale After: {CONFIG['stale_after']}")
     logging.debug('Display Title: ' + CONFIG['display_title'])
 
     #load cache file
     CACHE = CacheFile()
+    SCHEDULE = PollSchedule(CONFIG['poll_intervals'])
     logging.debug(f'Cache File: {CACHE.getFilePath()}')
 
+    #set up persistent ssh connections
+    multiplexing = CONFIG['ssh_multiplexing']
+    SSH_POOL = SSHConnectionPool(
+        os.path.join(os.path.dirname(os.path.realpath(__file__)), CONFIG['ssh_key']),
+        multiplexing=multiplexing.get('enabled', True),
+        control_path=multiplexing.get('control_path', ssh_connection.DEFAULT_CONTROL_PATH),
+        control_persist=multiplexing.get('control_persist', ssh_connection.DEFAULT_CONTROL_PERSIST),
+        health_check_interval=multiplexing.get('health_check_interval', ssh_connection.DEFAULT_HEALTH_CHECK_INTERVAL),
+        connect_timeout=CONFIG['command_timeout']
+    )
+    #close the master connections on the way out, instead of leaving them open for control_persist
+    atexit.register(SSH_POOL.close_all)
+
+    #set up the dns cache, and look up all the hosts ahead of time
+    dns = CONFIG['dns']
+    RESOLVER = HostResolver(
+        ttl=dns.get('ttl', host_resolver.DEFAULT_TTL),
+        negative_ttl=dns.get('negative_ttl', host_resolver.DEFAULT_NEGATIVE_TTL),
+        overrides=dns.get('overrides')
+    )
+    RESOLVER.prefetch([server['host'] for server in SERVERS])
+
+    #export timing metrics, if configured
+    metrics_config = CONFIG['metrics']
+    if metrics_config.get('port'):
+        metrics.start_http_server(metrics_config['port'], metrics_config.get('address', metrics.DEFAULT_ADDRESS))
+    if metrics_config.get('file'):
+        metrics.start_file_exporter(metrics_config['file'], metrics_config.get('file_interval', metrics.DEFAULT_FILE_INTERVAL))
+
+    #keep recent stats for each host, the memory for it is fixed by the retention and collection interval
+    HISTORY = MetricHistory(CONFIG['collection_interval'], retention=CONFIG['history'].get('retention', metric_history.DEFAULT_RETENTION))
+    logging.info(f'History: {HISTORY.capacity} samples per host, about {HISTORY.get_host_size() * SERVER_COUNT / 1000000:.1f} MB for {SERVER_COUNT} hosts')
+
+    #start grabbing data in the background
+    STORE = SnapshotStore()
+    breaker = CONFIG.get('circuit_breaker') or {}
+    BREAKER = CircuitBreaker(
+        failure_threshold=breaker.get('failure_threshold', circuit_breaker.DEFAULT_FAILURE_THRESHOLD),
+        backoff=breaker.get('backoff', circuit_breaker.DEFAULT_BACKOFF),
+        max_backoff=breaker.get('max_backoff', circuit_breaker.DEFAULT_MAX_BACKOFF)
+    )
+
+    #hosts running the metrics agent push their details, and are only grabbed over ssh if they stop
+    agent = CONFIG['agent']
+    skip = None
+    if agent.get('enabled'):
+        RECEIVER = AgentReceiver(
+            SERVERS, get_agent_details, STORE,
+            timeout=agent.get('timeout') or (3 * CONFIG['collection_interval']),
+            port=agent.get('port', agent_receiver.DEFAULT_PORT),
+            address=agent.get('address', agent_receiver.DEFAULT_ADDRESS),
+            key=agent.get('key'),
+            history=HISTORY,
+            breaker=BREAKER
+        )
+        RECEIVER.start()
+        skip = RECEIVER.is_pushing
+
+    COLLECTOR = Collector(SERVERS, get_server_details, STORE, CONFIG['collection_interval'], workers=CONFIG.get('collection_workers') or collector.DEFAULT_WORKERS, breaker=BREAKER, history=HISTORY, skip=skip)
+    COLLECTOR.start()
+
+    #serve what's been collected to other tools, if configured
+    api = CONFIG['api']
+    if api.get('port'):
+        API = SnapshotAPI(SERVERS, STORE, get_overview, port=api['port'], address=api.get('address', snapshot_api.DEFAULT_ADDRESS))
+        API.start()
+
     #run
     process_loop()
\ No newline at end of file
@@ -1,7 +1,10 @@
-from PIL import ImageFont, ImageDraw, Image
+from PIL import ImageFont, ImageDraw, Image, ImageChops
 import logging
+import functools
+import time
 
 from waveshare_epd import epd2in13_V4
+import metrics
 
 #write text to e-ink display utilizing https://github.com/waveshareteam/e-Paper
 #currently only for 2.13 inch display
@@ -16,6 +19,22 @@ IMAGE_MODE = '1'
 CENTER_Y = DISPLAY_DIMENSIONS['y'] // 2
 CENTER_X = DISPLAY_DIMENSIONS['x'] // 2
 
+#in partial refresh mode, how many partial refreshes to do before a full one to clear ghosting
+DEFAULT_FULL_REFRESH_INTERVAL = 10
+
+#how many text sizes to remember, titles, host names and labels repeat every cycle
+TEXT_SIZE_CACHE_SIZE = 512
+#how many rendered lines of text to remember
+TEXT_TILE_CACHE_SIZE = 256
+TEXT_COLOR = 0
+
+LAYOUT_SECONDS = metrics.histogram('text_layout_seconds', 'Time spent placing and drawing one piece of text on the page')
+GETBUFFER_SECONDS = metrics.histogram('getbuffer_seconds', 'Time spent converting the page into the panel buffer')
+SPI_SECONDS = metrics.histogram('spi_transfer_seconds', 'Time spent sending a frame to the panel, not counting busy waits, by refresh mode', ['mode'])
+BUSY_SECONDS = metrics.histogram('busy_wait_seconds', 'Time spent waiting on the panel busy pin during an update, by phase', ['phase'])
+REFRESHES = metrics.counter('refreshes_total', 'Panel refreshes, by refresh mode, skipped means the frame had not changed', ['mode'])
+UPDATE_FAILURES = metrics.counter('update_failures_total', 'Panel updates that timed out waiting on the panel')
+
 logger = logging.getLogger(__name__)
 
 def loadLinePositions(line_count, line_offset=0, margin_y=0):
@@ -32,11 +51,32 @@ def loadLinePositions(line_count, line_offset=0, margin_y=0):
 
     return line_positions, line_size
 
+#text is measured on one small shared image, instead of making a full size image every time
+MEASURE_DRAW = ImageDraw.Draw(Image.new(IMAGE_MODE, (1, 1), BACKGROUND_COLOR))
+
+@functools.lru_cache(maxsize=TEXT_SIZE_CACHE_SIZE)
+def get_text_bbox(text, font=None):
+    #returns the (left, top, right, bottom) of the ink when the text is drawn at (0, 0)
+    #left can be negative, ex: glyphs like j and / reach back past where the text starts
+    return MEASURE_DRAW.textbbox((0, 0), text, font=font)
+
+def get_text_size(text, font=None):
+    #returns the (width, height) of the text when drawn at (0, 0)
+    _, _, w, h = get_text_bbox(text, font)
+    return w, h
+
+@functools.lru_cache(maxsize=TEXT_TILE_CACHE_SIZE)
+def get_text_tile(text, font=None):
+    #renders the text once as a mask, so drawing it again is just a paste
+    #the mask covers the whole ink box, so pasting it at the position plus (left, top) matches drawing the text there
+    left, top, right, bottom = get_text_bbox(text, font)
+    tile = Image.new(IMAGE_MODE, (max(right - left, 1), max(bottom - top, 1)), 0)
+    ImageDraw.Draw(tile).text((-left, -top), text, font=font, fill=255)
+    return tile
+
 def get_text_center_position(text, font=None):
     #returns the position to display text at for it to be centered
-    image = Image.new(IMAGE_MODE, IMAGE_SIZE, BACKGROUND_COLOR)
-    draw = ImageDraw.Draw(image)
-    _, _, w, h = draw.textbbox((0, 0), text, font=font)
+    w, h = get_text_size(text, font)
     center = (CENTER_X - (w // 2), CENTER_Y - (h // 2))
 
     return center
@@ -49,17 +89,38 @@ def get_vertical_text_center_position(text, font=None):
 
 def get_text_right_justify_position(text, margin=0, font=None):
     #returns the position to display text at for it to be against the right side
-    image = Image.new(IMAGE_MODE, IMAGE_SIZE, BACKGROUND_COLOR)
-    draw = ImageDraw.Draw(image)
-    _, _, w, _ = draw.textbbox((0, 0), text, font=font)
+    w, _ = get_text_size(text, font)
     position = DISPLAY_DIMENSIONS['x'] - margin - w
 
     return position
 
+def loadLineBands(line_positions):
+    #returns the (top, bottom) rows covered by each line, the first and last lines stretch to the edges
+    bands = []
+    for i in range(len(line_positions)):
+        top = 0 if i == 0 else line_positions[i]
+        bottom = line_positions[i + 1] if i + 1 < len(line_positions) else DISPLAY_DIMENSIONS['y']
+        bands.append((top, bottom))
+
+    return bands
+
+def get_panel_window(box):
+    #converts a (left, top, right, bottom) box on the image to a (x_start, y_start, x_end, y_end) window on the panel
+    #the image is rotated 90 degrees for the panel, so image rows are panel columns and image columns are flipped panel rows
+    #panel columns are sent 8 at a time, so the window is widened to line up with them
+    left, top, right, bottom = box
+    x_start = top - (top % 8)
+    x_end = (bottom - 1) | 7
+    y_start = DISPLAY_DIMENSIONS['x'] - right
+    y_end = DISPLAY_DIMENSIONS['x'] - 1 - left
+
+    return x_start, y_start, x_end, y_end
+
 class epd_text:
-    def __init__(self, line_count, line_offset=0, margin_x=0, margin_y=0, font_file=None, font_size=None):
+    def __init__(self, line_count, line_offset=0, margin_x=0, margin_y=0, font_file=None, font_size=None, partial_refresh=False, full_refresh_interval=DEFAULT_FULL_REFRESH_INTERVAL, spi_speed_hz=None, busy_timeout=epd2in13_V4.DEFAULT_BUSY_TIMEOUT):
         self.line_positions, self.line_size = loadLinePositions(line_count)
         self.line_count = len(self.line_positions)
+        self.line_bands = loadLineBands(self.line_positions)
 
         if self.line_count % 2 == 0:
             self.middle_line = self.line_count // 2
@@ -70,6 +131,17 @@ class epd_text:
         self.margin_x = margin_x
         self.margin_y = margin_y
 
+        #partial refresh updates only the pixels that changed since the base image, which is faster and doesn't flash
+        self.partial_refresh = partial_refresh
+        self.full_refresh_interval = full_refresh_interval
+        self.partial_count = None
+
+        #what's currently on the panel, so partial refreshes only send the lines that changed
+        #and unchanged frames aren't sent at all
+        self.last_image = None
+        self.last_buffer = None
+        self.skipped_refreshes = 0
+
         logging.debug(f'IMAGE SIZE: {IMAGE_SIZE}')
         logging.debug(f'CENTER Y: {CENTER_Y}')
         logging.debug(f'CENTER X: {CENTER_X}')
@@ -80,6 +152,8 @@ class epd_text:
         logging.debug(f'MARGIN Y: {self.margin_y}')
         logging.debug(f'LINE SIZE: {self.line_size}')
         logging.debug(f'LINE_POSITIONS: {self.line_positions}')
+        logging.debug(f'PARTIAL REFRESH: {self.partial_refresh}')
+        logging.debug(f'FULL REFRESH INTERVAL: {self.full_refresh_interval}')
 
         self.font = None
         if font_file:
@@ -87,7 +161,7 @@ class epd_text:
 
         #initialize epd
         logging.info('Initializing E-Ink Display...')
-        self.epd = epd2in13_V4.EPD()
+        self.epd = epd2in13_V4.EPD(spi_speed_hz=spi_speed_hz, busy_timeout=busy_timeout)
         
         #self.epd.init()
         self.epd.init_fast()
@@ -107,6 +181,10 @@ class epd_text:
         self.image_draw = ImageDraw.Draw(self.image)
 
     def set_line_text(self, line, text, position=0, center=False, right_justify=False):
+        with LAYOUT_SECONDS.time():
+            self.layout_line_text(line, text, position, center, right_justify)
+
+    def layout_line_text(self, line, text, position=0, center=False, right_justify=False):
         if line >= self.line_count:
             logging.warning(f'Line [{line}] is above line count {self.line_count}.')
             return
@@ -123,33 +201,168 @@ class epd_text:
             position = get_horizontal_text_center_position(text, font=self.font)
 
         logging.debug(f'Writing text [{text}] at position [{position}] to line [{line}]...')
-        self.image_draw.text((position, self.line_positions[line]), text, font=self.font)
+        self.draw_text((position, self.line_positions[line]), text)
 
     def write_text(self, text, position=(0,0), center=False):
         #write text to screen directly
-        position = (position[0] + self.margin_x, position[1])
-        if center:
-            position = get_text_center_position(text, self.font)
-        
-        logging.debug(f'Writing text [{text}] at position [{position}]...')
-        self.image_draw.text(position, text, font=self.font)
+        with LAYOUT_SECONDS.time():
+            position = (position[0] + self.margin_x, position[1])
+            if center:
+                position = get_text_center_position(text, self.font)
+
+            logging.debug(f'Writing text [{text}] at position [{position}]...')
+            self.draw_text(position, text)
+
+    def draw_text(self, position, text):
+        #pastes the cached rendering of the text, only new text gets rendered
+        left, top, _, _ = get_text_bbox(text, self.font)
+        self.image.paste(TEXT_COLOR, (int(position[0]) + left, int(position[1]) + top), get_text_tile(text, self.font))
+
+    def get_line_box(self, line, left=0, right=DISPLAY_DIMENSIONS['x']):
+        #the (left, top, right, bottom) box for drawing inside a line, ex: a graph
+        top = self.line_positions[line]
+        return left, top + 1, right, top + self.line_size - 1
+
+    def draw_sparkline(self, box, columns, low, high):
+        #draws one (low, high) per pixel column inside the (left, top, right, bottom) box, scaled from low to high
+        #each unbroken run of columns is one polyline, zigzagging between the low and high of each column
+        left, top, right, bottom = box
+        height = bottom - top - 1
+        scale = height / ((high - low) or 1)
+
+        def get_y(value):
+            value = min(max(value, low), high)
+            return bottom - 1 - round((value - low) * scale)
+
+        with LAYOUT_SECONDS.time():
+            #baseline, so an empty graph still shows where it is
+            self.image_draw.line([(left, bottom - 1), (right - 1, bottom - 1)], fill=TEXT_COLOR)
+
+            points = []
+            for x, column in zip(range(left, right), columns):
+                if column is None:
+                    #a gap in the samples, ex: the host was offline
+                    self.draw_polyline(points)
+                    points = []
+                    continue
+
+                column_low, column_high = get_y(column[0]), get_y(column[1])
+                #keep the line continuous by starting each column at the end nearest the last point
+                if points and abs(points[-1][1] - column_high) < abs(points[-1][1] - column_low):
+                    points += [(x, column_high), (x, column_low)]
+                else:
+                    points += [(x, column_low), (x, column_high)]
+            self.draw_polyline(points)
+
+    def draw_polyline(self, points):
+        if len(points) == 1:
+            self.image_draw.point(points, fill=TEXT_COLOR)
+        elif points:
+            self.image_draw.line(points, fill=TEXT_COLOR)
 
     def clear(self):
         logging.debug('Clearing E-Ink Display...')
         self.epd.Clear(0xFF)
 
-    def update(self, partial=False, base=False):
+    def update(self, partial=None, base=False):
+        #if partial isn't given, partial refresh mode decides
         logging.debug('Updating E-Ink Display...')
 
+        try:
+            self.send_update(partial, base)
+        except TimeoutError as e:
+            #the panel stopped responding, reset it so the next update can go through
+            logging.error(f'E-Ink Display update failed: {e}')
+            UPDATE_FAILURES.inc()
+            self.recover()
+            return
+
+        logging.debug(f'E-Ink Display busy times: {self.epd.busy_times}')
+
+    def recover(self):
+        logging.warning('Resetting E-Ink Display...')
+        self.partial_count = None
+        self.last_image = None
+        self.last_buffer = None
+        try:
+            self.epd.reinit_fast()
+        except TimeoutError as e:
+            logging.error(f'E-Ink Display reset failed: {e}')
+
+    def send_update(self, partial=None, base=False):
+        #sends the image to the panel, raises TimeoutError if the panel doesn't respond
+        with GETBUFFER_SECONDS.time():
+            buffer = self.epd.getbuffer(self.image)
+
+        #the panel already shows this frame, so there's nothing to do
+        if self.last_buffer is not None and buffer == self.last_buffer:
+            self.skipped_refreshes += 1
+            REFRESHES.inc(mode='skipped')
+            logging.debug(f'Frame unchanged, skipping refresh ({self.skipped_refreshes} skipped so far)')
+            return
+
+        if partial is None:
+            partial = False
+            if self.partial_refresh:
+                #every so often do a full refresh to clear ghosting, and write a new base image
+                if self.partial_count is None or self.partial_count >= self.full_refresh_interval:
+                    logging.debug('Full refresh, writing base image...')
+                    if self.partial_count is not None:
+                        self.epd.reinit_fast()
+                    base = True
+                    self.partial_count = 0
+                else:
+                    partial = True
+                    self.partial_count += 1
+
+        #everything in the update that isn't waiting on the busy pin is spent sending over spi
+        start = time.perf_counter()
+        busy_totals = dict(self.epd.busy_totals)
+
         if partial:
-            self.epd.displayPartial(self.epd.getbuffer(self.image))
+            mode = 'partial'
+            windows = self.get_changed_windows()
+            if windows:
+                logging.debug(f'Sending changed windows: {windows}')
+                self.epd.displayPartialWindows(buffer, windows)
+            else:
+                self.epd.displayPartial(buffer)
         else:
             if base:
-                self.epd.displayPartBaseImage(self.epd.getbuffer(self.image))
+                mode = 'base'
+                self.epd.displayPartBaseImage(buffer)
             else:
-                #self.epd.display(self.epd.getbuffer(self.image))
-                self.epd.display_fast(self.epd.getbuffer(self.image))
-            
+                mode = 'fast'
+                #self.epd.display(buffer)
+                self.epd.display_fast(buffer)
+
+        busy = 0
+        for phase, total in self.epd.busy_totals.items():
+            waited = total - busy_totals.get(phase, 0)
+            if waited > 0:
+                BUSY_SECONDS.observe(waited, phase=phase)
+                busy += waited
+        SPI_SECONDS.observe(max(0, time.perf_counter() - start - busy), mode=mode)
+        REFRESHES.inc(mode=mode)
+
+        self.last_image = self.image.copy()
+        self.last_buffer = bytes(buffer)
+
+    def get_changed_windows(self):
+        #returns the panel windows covering what changed in each line since the last update
+        if self.last_image is None:
+            return None
+
+        difference = ImageChops.difference(self.image, self.last_image)
+        windows = []
+        for top, bottom in self.line_bands:
+            box = difference.crop((0, top, DISPLAY_DIMENSIONS['x'], bottom)).getbbox()
+            if box is not None:
+                left, box_top, right, box_bottom = box
+                windows.append(get_panel_window((left, top + box_top, right, top + box_bottom)))
+
+        return windows
+
     def show_line_test_page(self):
         self.new_image()
 
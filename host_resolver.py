@@ -0,0 +1,94 @@
+#caches host name -> ip address lookups so offline hosts don't block on the resolver every cycle
+#failed lookups are cached too, for a shorter time
+
+import socket
+import threading
+import time
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300
+DEFAULT_NEGATIVE_TTL = 30
+
+RESOLVE_SECONDS = metrics.histogram('dns_resolve_seconds', 'Time spent getting the address for a host, by where the address came from', ['source'])
+LOOKUPS = metrics.counter('dns_lookups_total', 'Host name lookups sent to the resolver', ['result'])
+
+class HostResolver:
+    def __init__(self, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, overrides=None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        #static host -> ip mappings that skip the resolver entirely
+        self.overrides = overrides or {}
+
+        #host -> (ip or None, expiry time)
+        self.cache = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def __lookup(self, host):
+        #tries the host name, then mdns
+        for name in (host, f'{host}.local'):
+            try:
+                return socket.gethostbyname(name)
+            except socket.gaierror as e:
+                logging.warning(f'Failed to resolve {name}: {e}')
+
+        return None
+
+    def __refresh(self, host):
+        ip = self.__lookup(host)
+        LOOKUPS.inc(result='resolved' if ip is not None else 'failed')
+        ttl = self.ttl if ip is not None else self.negative_ttl
+
+        with self.lock:
+            self.cache[host] = (ip, time.monotonic() + ttl)
+            self.refreshing.discard(host)
+
+        return ip
+
+    def __refreshInBackground(self, host):
+        with self.lock:
+            if host in self.refreshing:
+                return
+            self.refreshing.add(host)
+
+        threading.Thread(target=self.__refresh, args=(host,), daemon=True).start()
+
+    def resolve(self, host):
+        #returns the ip address for the host, or None if it can't be resolved
+        start = time.perf_counter()
+        if host in self.overrides:
+            RESOLVE_SECONDS.observe(time.perf_counter() - start, source='override')
+            return self.overrides[host]
+
+        with self.lock:
+            entry = self.cache.get(host)
+
+        #never looked up, so there's nothing to fall back on
+        if entry is None:
+            ip = self.__refresh(host)
+            RESOLVE_SECONDS.observe(time.perf_counter() - start, source='lookup')
+            return ip
+
+        #expired entries are still used while a new lookup runs in the background
+        ip, expiry = entry
+        source = 'cache'
+        if expiry <= time.monotonic():
+            logging.debug(f'Cached address for {host} expired, refreshing...')
+            self.__refreshInBackground(host)
+            source = 'stale'
+
+        RESOLVE_SECONDS.observe(time.perf_counter() - start, source=source)
+        return ip
+
+    def prefetch(self, hosts):
+        #looks up several hosts ahead of time, all at once
+        threads = [threading.Thread(target=self.resolve, args=(host,), daemon=True) for host in hosts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
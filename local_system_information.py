@@ -0,0 +1,166 @@
+#reads the same values as raspberry_pi_system_information_commands directly from /proc and /sys
+#used for the local host so it doesn't have to start a shell for every value
+#run this file directly to compare the values against the shell commands
+
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+#lscpu names arm cpus from the cpu part number in /proc/cpuinfo
+ARM_CPU_PARTS = {
+    '0xb76': 'ARM1176',
+    '0xc07': 'Cortex-A7',
+    '0xd03': 'Cortex-A53',
+    '0xd08': 'Cortex-A72',
+    '0xd0b': 'Cortex-A76',
+}
+
+#the last /proc/stat sample, so cpu load covers the time since the last call
+last_cpu_times = None
+cpu_times_lock = threading.Lock()
+
+def read_file(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+def read_key_values(path, separator=':'):
+    #returns a list of (key, value) pairs from files like /proc/cpuinfo and /proc/meminfo
+    pairs = []
+    for line in read_file(path).splitlines():
+        if separator in line:
+            key, value = line.split(separator, 1)
+            pairs.append((key.strip(), value.strip()))
+    return pairs
+
+def read_meminfo():
+    #returns /proc/meminfo as a dictionary of name -> kB
+    return {key: int(value.split()[0]) for key, value in read_key_values('/proc/meminfo')}
+
+def get_model():
+    #the raspberry pi model from /proc/cpuinfo
+    return '\n'.join(' '.join(value.split()) for key, value in read_key_values('/proc/cpuinfo') if 'Model' in key)
+
+def get_operating_system():
+    for key, value in read_key_values('/etc/os-release', separator='='):
+        if key == 'PRETTY_NAME':
+            return value.split('=')[0].replace('"', '')
+    return ''
+
+def get_cpu_model():
+    #matches the model names from lscpu, arm cpus are named from their part number and others use the model name
+    cpuinfo = read_key_values('/proc/cpuinfo')
+    if any(key == 'CPU part' for key, _ in cpuinfo):
+        models = [ARM_CPU_PARTS.get(value.lower(), value) for key, value in cpuinfo if key == 'CPU part']
+    else:
+        models = [' '.join(value.split()) for key, value in cpuinfo if key == 'model name']
+
+    #one line per distinct model, in order
+    return '\n'.join(dict.fromkeys(models))
+
+def get_architecture():
+    return os.uname().machine
+
+def read_cpu_times():
+    #returns (idle, total) jiffies for all cpus
+    fields = [int(value) for value in read_file('/proc/stat').splitlines()[0].split()[1:]]
+    #idle and iowait
+    idle = fields[3] + fields[4]
+    #guest time is already counted in user time
+    total = sum(fields[:8])
+    return idle, total
+
+def get_cpu_load():
+    #cpu usage percentage since the last call, or since boot for the first call
+    global last_cpu_times
+
+    idle, total = read_cpu_times()
+    with cpu_times_lock:
+        last_idle, last_total = last_cpu_times or (0, 0)
+        last_cpu_times = (idle, total)
+
+    if total == last_total:
+        return '0'
+
+    load = 100 - (((idle - last_idle) / (total - last_total)) * 100)
+    return f'{round(load, 1):g}'
+
+def get_cpu_temperature():
+    return read_file('/sys/class/thermal/thermal_zone0/temp').strip()
+
+def get_memory():
+    #total memory in megabytes, like free --mega
+    return str(read_meminfo()['MemTotal'] * 1024 // 1000000)
+
+def get_used_memory_percentage():
+    #free counts used memory as total - available
+    meminfo = read_meminfo()
+    used = meminfo['MemTotal'] - meminfo['MemAvailable']
+    return f"{(used / meminfo['MemTotal']) * 100:g}"
+
+def get_boot_id():
+    return read_file('/proc/sys/kernel/random/boot_id').strip()
+
+#system information command name -> function
+COMMANDS = {
+    'MODEL': get_model,
+    'OPERATING_SYSTEM': get_operating_system,
+    'CPU_MODEL': get_cpu_model,
+    'ARCHITECTURE': get_architecture,
+    'CPU_LOAD': get_cpu_load,
+    'CPU_TEMPERATURE': get_cpu_temperature,
+    'MEMORY': get_memory,
+    'USED_MEMORY_PERCENTAGE': get_used_memory_percentage,
+    'BOOT_ID': get_boot_id,
+}
+
+def get_values(names):
+    #returns a dictionary of command name -> value, like raspberry_pi_system_information_commands.parse_batch_output
+    values = {}
+    for name in names:
+        try:
+            values[name] = COMMANDS[name]()
+        except (OSError, KeyError, ValueError, IndexError) as e:
+            #missing files, ex: no thermal zone, give an empty value like the shell commands would
+            logging.warning(f'Failed to read {name}: {e}')
+            values[name] = ''
+    return values
+
+#values that change between running the shell command and reading them here, name -> how far apart they can be
+#cpu load is sampled over different periods, so it isn't compared at all
+TOLERANCES = {
+    'CPU_LOAD': None,
+    'USED_MEMORY_PERCENTAGE': 1,
+}
+
+def matches(name, shell, local):
+    #true if a value read here matches the one from the shell command
+    if name not in TOLERANCES:
+        return shell == local
+    if TOLERANCES[name] is None:
+        return True
+    try:
+        return abs(float(shell) - float(local)) <= TOLERANCES[name]
+    except ValueError:
+        return shell == local
+
+if __name__ == '__main__':
+    import sys
+    import subprocess
+    import raspberry_pi_system_information_commands as RSYSINFO
+
+    #compare against the shell commands, exits with 1 if any of them differ
+    failed = False
+    for name in COMMANDS.keys():
+        shell = subprocess.run(getattr(RSYSINFO, name), shell=True, capture_output=True).stdout.decode().strip()
+        local = get_values([name])[name]
+        if shell == local:
+            result = 'OK  '
+        elif matches(name, shell, local):
+            result = 'NEAR'
+        else:
+            result = 'DIFF'
+            failed = True
+        print(f"{result} {name}: shell [{shell}] local [{local}]")
+    sys.exit(1 if failed else 0)
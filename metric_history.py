@@ -0,0 +1,144 @@
+#keeps recent cpu load, cpu temperature and memory usage samples for each host
+#samples live in fixed size ring buffers made from arrays, so memory use is set up front and appending never allocates
+
+import math
+import array
+import bisect
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+#details key -> what's recorded for each host
+METRICS = ('cpu_load', 'cpu_temp', 'used_memory')
+
+#how many seconds of samples to keep
+DEFAULT_RETENTION = 86400
+
+#array type codes, 4 byte unsigned seconds since the epoch and 4 byte floats
+TIME_TYPE = 'I'
+VALUE_TYPE = 'f'
+
+#recorded for a metric the host didn't return, ex: the host was offline
+MISSING = float('nan')
+
+class RingBuffer:
+    def __init__(self, capacity, metrics=METRICS):
+        #one shared time column, and one value column per metric
+        self.capacity = capacity
+        self.metrics = metrics
+        self.times = array.array(TIME_TYPE, bytes(array.array(TIME_TYPE).itemsize * capacity))
+        self.values = {metric: array.array(VALUE_TYPE, bytes(array.array(VALUE_TYPE).itemsize * capacity)) for metric in metrics}
+
+        #where the next sample goes, and how many samples are kept
+        self.next = 0
+        self.count = 0
+
+    def append(self, timestamp, values):
+        #overwrites the oldest sample once the buffer is full
+        i = self.next
+        self.times[i] = int(timestamp)
+        for metric in self.metrics:
+            self.values[metric][i] = values.get(metric, MISSING)
+
+        self.next = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def get_segments(self):
+        #the (start, end) slices of the arrays holding the samples, oldest first
+        start = (self.next - self.count) % self.capacity
+        if start + self.count <= self.capacity:
+            return [(start, start + self.count)]
+        return [(start, self.capacity), (0, self.next)]
+
+    def get(self, metric, since=None):
+        #returns (times, values) from oldest to newest, only samples at or after since if it's given
+        #samples are appended in time order, so the start of the window is found with a binary search
+        times = []
+        values = []
+        column = self.values[metric]
+        for start, end in self.get_segments():
+            if since is not None:
+                start = bisect.bisect_left(self.times, since, start, end)
+            times += self.times[start:end].tolist()
+            values += column[start:end].tolist()
+        return times, values
+
+class MetricHistory:
+    def __init__(self, interval, retention=DEFAULT_RETENTION, metrics=METRICS):
+        #interval is how often hosts are sampled, so the buffers can be sized to cover the retention window
+        self.interval = interval
+        self.retention = retention
+        self.metrics = metrics
+        self.capacity = max(1, math.ceil(retention / interval))
+
+        #host -> ring buffer
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def get_sample_size(self):
+        #bytes for one sample of every metric
+        return array.array(TIME_TYPE).itemsize + array.array(VALUE_TYPE).itemsize * len(self.metrics)
+
+    def get_host_size(self):
+        #bytes for one host's buffer
+        return self.capacity * self.get_sample_size()
+
+    def record(self, host, details, timestamp=None):
+        #adds a sample from the host's details, metrics it doesn't have are recorded as missing
+        values = {}
+        if details.get('accessible'):
+            for metric in self.metrics:
+                try:
+                    values[metric] = float(details[metric])
+                except (KeyError, TypeError, ValueError):
+                    pass
+
+        with self.lock:
+            buffer = self.buffers.get(host)
+            if buffer is None:
+                buffer = self.buffers[host] = RingBuffer(self.capacity, self.metrics)
+            buffer.append(time.time() if timestamp is None else timestamp, values)
+
+    def get(self, host, metric, since=None):
+        #returns (times, values) for the host from oldest to newest, missing samples are nan
+        with self.lock:
+            buffer = self.buffers.get(host)
+            if buffer is None:
+                return [], []
+            return buffer.get(metric, since)
+
+def downsample(series, start, end, columns):
+    #squeezes samples into one (low, high) per column for drawing, columns with no samples are None
+    #series is a list of (times, values), so several hosts can share the same columns
+    lows = [math.inf] * columns
+    highs = [-math.inf] * columns
+    scale = columns / (end - start)
+
+    for times, values in series:
+        first = bisect.bisect_left(times, start)
+        last = bisect.bisect_left(times, end)
+        for t, value in zip(times[first:last], values[first:last]):
+            #nan is never equal to itself, missing samples are skipped
+            if value != value:
+                continue
+            column = min(int((t - start) * scale), columns - 1)
+            if value < lows[column]:
+                lows[column] = value
+            if value > highs[column]:
+                highs[column] = value
+
+    return [(low, high) if low <= high else None for low, high in zip(lows, highs)]
+
+def average_columns(column_lists):
+    #averages several downsampled series column by column, ex: every host in the rack
+    #columns missing from some series are averaged over the series that have them
+    averaged = []
+    for columns in zip(*column_lists):
+        present = [column for column in columns if column is not None]
+        if present:
+            averaged.append((sum(low for low, _ in present) / len(present), sum(high for _, high in present) / len(present)))
+        else:
+            averaged.append(None)
+    return averaged
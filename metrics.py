@@ -0,0 +1,204 @@
+#counters and histograms for where each cycle's time goes
+#exported in the prometheus text format, to a file (ex: for the node exporter textfile collector) or a small local http endpoint
+
+import os
+import bisect
+import threading
+import time
+import logging
+import contextlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+#every metric name starts with this
+PREFIX = 'server_rack_display_'
+
+#histogram buckets in seconds, from quick cache lookups up to slow ssh commands and full refreshes
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+DEFAULT_ADDRESS = '127.0.0.1'
+DEFAULT_PORT = 9105
+DEFAULT_FILE_INTERVAL = 15
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return f'{value:g}' if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, description, labels=()):
+        self.name = PREFIX + name
+        self.description = description
+        self.labels = tuple(labels)
+
+        #label values -> count, metrics without labels start at zero so they show up before anything happens
+        self.values = {} if self.labels else {(): 0}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self.lock:
+            return self.values.get(key, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, key)} {format_value(value)}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = PREFIX + name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+
+        #label values -> [count per bucket, plus one for anything bigger], sum, count
+        self.values = {} if self.labels else {(): [[0] * (len(self.buckets) + 1), 0.0, 0]}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        #times the block, even if it raises
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                #prometheus buckets are cumulative
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{format_labels(self.labels, key, [("le", format_value(float(bound)))])} {cumulative}')
+                lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}')
+                lines.append(f'{self.name}_count{format_labels(self.labels, key)} {count}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        #name -> metric, in the order they were made
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def __get(self, cls, name, description, labels, **kwargs):
+        #modules make their metrics at import time, asking twice gives back the same one
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, description, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'Metric {name} already exists as a {type(metric).__name__}')
+            return metric
+
+    def counter(self, name, description, labels=()):
+        return self.__get(Counter, name, description, labels)
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.__get(Histogram, name, description, labels, buckets=buckets)
+
+    def render(self):
+        #the prometheus text format for every metric
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def counter(name, description, labels=()):
+    return REGISTRY.counter(name, description, labels)
+
+def histogram(name, description, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, description, labels, buckets)
+
+def render():
+    return REGISTRY.render()
+
+def write_file(path):
+    #written to a temporary file and swapped in, so readers never see a half written file
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(render())
+    os.replace(temp_path, path)
+
+def start_file_exporter(path, interval=DEFAULT_FILE_INTERVAL):
+    #rewrites the metrics file every interval seconds
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    def run():
+        while True:
+            try:
+                write_file(path)
+            except OSError as e:
+                logging.warning(f'Failed to write metrics file [{path}]: {e}')
+            time.sleep(interval)
+
+    logging.info(f'Writing metrics to [{path}] every {interval} seconds...')
+    thread = threading.Thread(target=run, name='metrics-file', daemon=True)
+    thread.start()
+    return thread
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        #scrapes are frequent, keep them out of the info log
+        logging.debug(f'Metrics request: {format % args}')
+
+def start_http_server(port=DEFAULT_PORT, address=DEFAULT_ADDRESS):
+    #serves the metrics at http://address:port/metrics
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+
+    logging.info(f'Serving metrics on http://{address}:{port}/metrics...')
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,88 @@
+#small agent to run on each server, pushes its details to the display over udp instead of the display connecting over ssh
+#needs only this file and local_system_information.py, copy both to the server and run:
+#python3 metrics_agent.py --display {display host}
+
+import os
+import sys
+import json
+import time
+import hmac
+import hashlib
+import socket
+import argparse
+import logging
+
+import local_system_information as LOCALSYSINFO
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 9106
+DEFAULT_INTERVAL = 10
+
+#datagram format version, the receiver drops versions it doesn't know
+VERSION = 1
+
+#what gets sent, the same commands the display would run over ssh
+VALUES = ['MODEL', 'OPERATING_SYSTEM', 'CPU_MODEL', 'ARCHITECTURE', 'MEMORY', 'CPU_LOAD', 'CPU_TEMPERATURE', 'USED_MEMORY_PERCENTAGE', 'BOOT_ID']
+
+def sign(payload, key):
+    return hmac.new(key.encode(), payload, hashlib.sha256).hexdigest()
+
+def build_datagram(host, values, key=None):
+    #compact json, with a signature in front if there's a shared key: {signature} {json}
+    payload = json.dumps({'v': VERSION, 'host': host, 'time': time.time(), 'values': values}, separators=(',', ':')).encode()
+    if key:
+        payload = sign(payload, key).encode() + b' ' + payload
+    return payload
+
+def parse_datagram(datagram, key=None):
+    #returns the message from a datagram, raises ValueError if it's malformed or the signature doesn't match
+    if key:
+        signature, _, payload = datagram.partition(b' ')
+        if not hmac.compare_digest(signature, sign(payload, key).encode()):
+            raise ValueError('bad signature')
+    else:
+        payload = datagram
+
+    message = json.loads(payload)
+    if not isinstance(message, dict) or message.get('v') != VERSION:
+        raise ValueError('unknown version')
+    if not isinstance(message.get('host'), str) or not isinstance(message.get('values'), dict) or not isinstance(message.get('time'), (int, float)):
+        raise ValueError('missing fields')
+    return message
+
+def main():
+    parser = argparse.ArgumentParser(description='Push this machine\'s details to the server rack display.')
+    parser.add_argument('--display', required=True, help='host name or ip address of the display')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='udp port the display listens on')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help='seconds between pushes')
+    parser.add_argument('--host', default=socket.gethostname(), help='name to report, must match the host in the display config')
+    parser.add_argument('--key', default=os.getenv('METRICS_AGENT_KEY'), help='shared key to sign pushes with, defaults to the METRICS_AGENT_KEY environment variable')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.info(f'Pushing details for {args.host} to {args.display}:{args.port} every {args.interval} seconds...')
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    #the first cpu load covers everything since boot, so take a sample to start from
+    LOCALSYSINFO.get_values(['CPU_LOAD'])
+
+    deadline = time.monotonic()
+    while True:
+        deadline += args.interval
+        time.sleep(max(0, deadline - time.monotonic()))
+
+        datagram = build_datagram(args.host, LOCALSYSINFO.get_values(VALUES), args.key)
+        try:
+            #looked up every time, so a display that moves is followed
+            sock.sendto(datagram, (args.display, args.port))
+        except OSError as e:
+            #the display may be down or unreachable for now, keep going
+            logging.warning(f'Failed to push to {args.display}:{args.port}: {e}')
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,54 @@
+#keeps track of when each metric was last grabbed from each host, so only the ones that are due get grabbed
+#metrics that aren't due reuse the last value grabbed
+
+import threading
+import time
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+POLLS = metrics.counter('poll_metrics_total', 'Metrics needed for a host, by whether they were grabbed or the last value was reused', ['metric', 'result'])
+
+class PollSchedule:
+    def __init__(self, intervals):
+        #intervals is details key -> seconds between grabs, 0 grabs it every time
+        self.intervals = dict(intervals)
+
+        #host -> details key -> (monotonic time grabbed, value)
+        self.last = {}
+        self.lock = threading.Lock()
+
+    def get_due(self, host):
+        #returns the details keys that need grabbing for the host, reused keys are counted here, grabbed ones in update
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            last = self.last.get(host, {})
+            for key, interval in self.intervals.items():
+                if key not in last or now - last[key][0] >= interval:
+                    due.append(key)
+                else:
+                    POLLS.inc(metric=key, result='reused')
+        return due
+
+    def update(self, host, values):
+        #saves freshly grabbed details key -> value for the host
+        now = time.monotonic()
+        with self.lock:
+            last = self.last.setdefault(host, {})
+            for key, value in values.items():
+                last[key] = (now, value)
+                POLLS.inc(metric=key, result='grabbed')
+
+    def get_values(self, host):
+        #returns details key -> last value grabbed for the host
+        with self.lock:
+            return {key: value for key, (_, value) in self.last.get(host, {}).items()}
+
+    def expire(self, host):
+        #makes everything due for the host next time, ex: it rebooted, the last values are kept until then
+        with self.lock:
+            for key, (_, value) in self.last.get(host, {}).items():
+                self.last[host][key] = (float('-inf'), value)
@@ -16,4 +16,33 @@ FREE_STORAGE = """df -h | awk '$6 == "/" {print $4}'"""
 USED_STORAGE_PERCENTAGE = """df -h | awk '$6 == "/" {print $5}'"""
 CPU_TEMPERATURE = "cat /sys/class/thermal/thermal_zone0/temp"
 OPERATING_SYSTEM = """cat /etc/os-release | grep "PRETTY_NAME" | awk '{split($0, a, "="); print a[2]}' | tr -d '"'"""
-UPTIME = "uptime | awk '{print $3}' | tr -d ','"
\ No newline at end of file
+UPTIME = "uptime | awk '{print $3}' | tr -d ','"
+BOOT_ID = "cat /proc/sys/kernel/random/boot_id"
+
+#batch collection
+#runs several of the commands above in one shell invocation so they only cost one round trip
+#each command's output is preceded by a marker line with the command's name
+BATCH_MARKER = '###RSYSINFO###'
+
+def build_batch_command(names):
+    #names are the names of the commands above, ex: ['CPU_LOAD', 'MEMORY']
+    return '; '.join(f"echo '{BATCH_MARKER}{name}'; {globals()[name]}" for name in names)
+
+def parse_batch_output(output):
+    #returns a dictionary of command name -> output
+    values = {}
+    name = None
+    lines = []
+    for line in output.splitlines():
+        if line.startswith(BATCH_MARKER):
+            if name is not None:
+                values[name] = '\n'.join(lines).strip()
+            name = line[len(BATCH_MARKER):].strip()
+            lines = []
+        elif name is not None:
+            lines.append(line)
+
+    if name is not None:
+        values[name] = '\n'.join(lines).strip()
+
+    return values
@@ -0,0 +1,132 @@
+#serves the latest details the collector already has as json, so other tools don't have to grab them from the machines again
+#requests only read the snapshot store, they never start a collection
+#responses carry an etag, so clients polling with If-None-Match get a 304 until something changes
+
+import json
+import hashlib
+import threading
+import logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = '127.0.0.1'
+DEFAULT_PORT = 9107
+
+CONTENT_TYPE = 'application/json'
+
+#paths with the overview in them
+OVERVIEW_PATHS = ('/api', '/api/overview')
+
+REQUESTS = metrics.counter('api_requests_total', 'Snapshot api requests, by response status', ['status'])
+
+class SnapshotAPI:
+    def __init__(self, servers, store, overview, port=DEFAULT_PORT, address=DEFAULT_ADDRESS):
+        #overview is called as overview(dictionary of host -> (details, time collected)) and returns the summary page numbers
+        self.hosts = [server['host'] for server in servers]
+        self.store = store
+        self.overview = overview
+        self.port = port
+        self.address = address
+
+        #path -> (store version, etag, body), bodies are only rebuilt after the store changes
+        #the overview also changes when hosts go stale without a store update, so it's always rebuilt
+        self.responses = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        #the handler is made by the server for each request, so it finds the api through its class
+        handler = type('Handler', (SnapshotHandler,), {'api': self})
+        self.server = ThreadingHTTPServer((self.address, self.port), handler)
+        self.server.daemon_threads = True
+
+        logging.info(f'Serving snapshots on http://{self.address}:{self.port}/api...')
+        threading.Thread(target=self.server.serve_forever, name='snapshot-api', daemon=True).start()
+
+    def build(self, path, snapshots):
+        #returns the response data for the path, or None if there's nothing there
+        def get_host(host):
+            details, updated = snapshots.get(host, (None, None))
+            return {'details': details, 'updated': updated}
+
+        if path == '/api':
+            return {
+                'hosts': {host: get_host(host) for host in self.hosts},
+                'overview': self.get_overview(snapshots),
+            }
+        elif path == '/api/hosts':
+            return {host: get_host(host) for host in self.hosts}
+        elif path.startswith('/api/hosts/'):
+            host = unquote(path[len('/api/hosts/'):])
+            return get_host(host) if host in self.hosts else None
+        elif path == '/api/overview':
+            return self.get_overview(snapshots)
+        return None
+
+    def get_overview(self, snapshots):
+        overview = self.overview({host: snapshots[host] for host in self.hosts if host in snapshots})
+        overview['updated'] = max((snapshots[host][1] for host in self.hosts if host in snapshots), default=None)
+        return overview
+
+    def get_response(self, path):
+        #returns (etag, body) for the path, or None if there's nothing there
+        version, snapshots = self.store.get_all_versioned()
+        cacheable = path not in OVERVIEW_PATHS
+        if cacheable:
+            with self.lock:
+                cached = self.responses.get(path)
+            if cached is not None and cached[0] == version:
+                return cached[1], cached[2]
+
+        data = self.build(path, snapshots)
+        if data is None:
+            return None
+
+        #the etag comes from the body, so it only changes when the response does, even across restarts
+        body = json.dumps(data, separators=(',', ':')).encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if cacheable:
+            with self.lock:
+                #only one response per known path is kept, unknown hosts never get here
+                self.responses[path] = (version, etag, body)
+        return etag, body
+
+class SnapshotHandler(BaseHTTPRequestHandler):
+    api = None
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        response = self.api.get_response(path)
+        if response is None:
+            REQUESTS.inc(status=404)
+            self.send_error(404)
+            return
+
+        etag, body = response
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+        #the client already has this version
+        tags = [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]
+        if etag in tags or '*' in tags:
+            REQUESTS.inc(status=304)
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        REQUESTS.inc(status=200)
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f'Snapshot api request: {format % args}')
@@ -0,0 +1,44 @@
+#holds the latest details for each host, shared between the collector and the display
+
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SnapshotStore:
+    def __init__(self):
+        #host -> (details, time collected)
+        self.snapshots = {}
+        self.condition = threading.Condition()
+
+        #goes up with every update, so readers can tell when anything changed
+        self.version = 0
+
+    def update(self, host, details):
+        with self.condition:
+            self.snapshots[host] = (details, time.time())
+            self.version += 1
+            self.condition.notify_all()
+
+    def get_all_versioned(self):
+        #returns (version, dictionary of host -> (details, time collected)) from the same moment
+        with self.condition:
+            return self.version, dict(self.snapshots)
+
+    def get(self, host):
+        #returns the latest details for the host, or None if there are none yet
+        with self.condition:
+            snapshot = self.snapshots.get(host)
+        return None if snapshot is None else snapshot[0]
+
+    def get_updated(self, host):
+        #returns the time the host's details were collected, or None if there are none yet
+        with self.condition:
+            snapshot = self.snapshots.get(host)
+        return None if snapshot is None else snapshot[1]
+
+    def wait_for(self, hosts, timeout=None):
+        #waits until every host has details, returns false if the timeout ran out first
+        with self.condition:
+            return self.condition.wait_for(lambda: all(host in self.snapshots for host in hosts), timeout)
@@ -0,0 +1,108 @@
+#keeps one long lived ssh connection per host using openssh connection multiplexing
+#commands are sent over the existing connection instead of doing a full handshake each time
+
+import subprocess
+import shlex
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTROL_PATH = '/tmp/server-rack-display-%C'
+DEFAULT_CONTROL_PERSIST = 600
+DEFAULT_HEALTH_CHECK_INTERVAL = 60
+DEFAULT_CONNECT_TIMEOUT = 10
+
+#ssh exits with 255 when the connection itself failed, rather than the remote command
+SSH_CONNECTION_ERROR = 255
+
+class SSHConnectionPool:
+    def __init__(self, ssh_key, multiplexing=True, control_path=DEFAULT_CONTROL_PATH, control_persist=DEFAULT_CONTROL_PERSIST, health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL, connect_timeout=DEFAULT_CONNECT_TIMEOUT):
+        self.ssh_key = ssh_key
+        self.connect_timeout = connect_timeout
+        self.multiplexing = multiplexing
+        self.control_path = control_path
+        self.control_persist = control_persist
+        self.health_check_interval = health_check_interval
+
+        #last successful health check per connection
+        self.checked = {}
+        self.lock = threading.Lock()
+
+    def __getOptions(self):
+        options = f'-o StrictHostKeyChecking=no -o ConnectTimeout={self.connect_timeout} -i {self.ssh_key}'
+        if self.multiplexing:
+            options += f' -o ControlPath={self.control_path}'
+        return options
+
+    def __runControlCommand(self, arguments, deadline=None):
+        #runs an ssh command against the local connection, returns true if it worked
+        #if a monotonic deadline is given, the command is given up on by then
+        timeout = self.connect_timeout * 2
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                logging.warning(f'No time left for ssh control command: {arguments}')
+                return False
+
+        command = f'ssh {self.__getOptions()} {arguments}'
+        logging.debug(f'Running ssh control command: {command}')
+        try:
+            result = subprocess.run(shlex.split(command), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logging.warning(f'SSH control command timed out: {command}')
+            return False
+        return result.returncode == 0
+
+    def check(self, user, host, deadline=None):
+        #returns true if there is a live master connection for the host
+        return self.__runControlCommand(f'-O check {user}@{host}', deadline)
+
+    def connect(self, user, host, deadline=None):
+        #opens a master connection in the background that stays open for control_persist seconds after last use
+        #auto instead of yes, so a control socket left behind by a master that died is removed instead of stopping it binding,
+        #which would leave a plain background ssh running that is never multiplexed
+        logging.info(f'Opening ssh connection to {user}@{host}...')
+        return self.__runControlCommand(f'-f -N -o ControlMaster=auto -o ControlPersist={self.control_persist} {user}@{host}', deadline)
+
+    def disconnect(self, user, host, deadline=None):
+        logging.info(f'Closing ssh connection to {user}@{host}...')
+        with self.lock:
+            self.checked.pop((user, host), None)
+        return self.__runControlCommand(f'-O exit {user}@{host}', deadline)
+
+    def ensure_connection(self, user, host, deadline=None):
+        #health check the master connection every so often, and reconnect if it went away
+        if not self.multiplexing:
+            return
+
+        key = (user, host)
+        with self.lock:
+            last_check = self.checked.get(key)
+        if last_check is not None and time.monotonic() - last_check < self.health_check_interval:
+            return
+
+        if not self.check(user, host, deadline):
+            logging.info(f'No live ssh connection to {user}@{host}.')
+            if not self.connect(user, host, deadline):
+                logging.warning(f'Failed to open ssh connection to {user}@{host}.')
+                return
+
+        with self.lock:
+            self.checked[key] = time.monotonic()
+
+    def build_command(self, command, user, host):
+        #if there is no master connection, ControlMaster=no falls back to a normal connection
+        options = self.__getOptions()
+        if self.multiplexing:
+            options += ' -o ControlMaster=no'
+
+        #quote the command so the whole pipeline runs on the remote host
+        return f'ssh {options} {user}@{host} {shlex.quote(command)}'
+
+    def close_all(self):
+        with self.lock:
+            connections = list(self.checked.keys())
+        for user, host in connections:
+            self.disconnect(user, host)
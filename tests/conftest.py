@@ -0,0 +1,9 @@
+#tests run against the simulated panel from the repository root, so no hardware or install is needed
+
+import os
+import sys
+
+os.environ.setdefault('EPD_BACKEND', 'simulated')
+os.environ.setdefault('EPD_SIMULATED_TIME_SCALE', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
@@ -0,0 +1,52 @@
+#cached text tiles have to draw exactly what drawing the text directly would
+#run with: python -m pytest tests
+
+import os
+import string
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import epd_text as epd_text_module
+from epd_text import epd_text, loadLinePositions, IMAGE_MODE, IMAGE_SIZE, BACKGROUND_COLOR, TEXT_COLOR
+
+#a font file to also check, ex: the one from the config, set with EPD_TEST_FONT
+FONTS = [('default', lambda: ImageFont.load_default())]
+if os.getenv('EPD_TEST_FONT'):
+    FONTS.append(('EPD_TEST_FONT', lambda: ImageFont.truetype(os.getenv('EPD_TEST_FONT'), 13)))
+
+def make_display(font):
+    #only the drawing is checked, so the panel set up in __init__ is skipped
+    display = epd_text.__new__(epd_text)
+    display.line_positions, display.line_size = loadLinePositions(6)
+    display.line_count = len(display.line_positions)
+    display.margin_x = 1
+    display.font = font
+    display.new_image()
+    return display
+
+def draw_directly(text, position, font):
+    image = Image.new(IMAGE_MODE, IMAGE_SIZE, BACKGROUND_COLOR)
+    ImageDraw.Draw(image).text(position, text, font=font, fill=TEXT_COLOR)
+    return image
+
+def get_negative_bearing_glyphs(font):
+    #glyphs whose ink starts left of where they're drawn
+    return [glyph for glyph in string.printable.strip() if epd_text_module.get_text_bbox(glyph, font)[0] < 0]
+
+@pytest.fixture(params=FONTS, ids=[name for name, _ in FONTS])
+def font(request):
+    return request.param[1]()
+
+def test_tiles_match_direct_drawing(font):
+    glyphs = get_negative_bearing_glyphs(font)
+    texts = ['jay', '/\\ fj', 'CPU: Cortex-A53 (aarch64),  4.5%,  41°C', string.printable.strip()] + glyphs + [f'a{glyph}b' for glyph in glyphs]
+
+    for text in texts:
+        #centered, somewhere in the middle, and right against the edge where ink left of 0 is cut off
+        center = epd_text_module.get_text_center_position(text, font)
+        for position in (center, (116, 34), (0, 0), (1, 5)):
+            display = make_display(font)
+            display.draw_text(position, text)
+            expected = draw_directly(text, position, font)
+            assert display.image.tobytes() == expected.tobytes(), f'[{text}] at {position}'
@@ -0,0 +1,22 @@
+#the values read locally have to match what the shell commands give for the same host
+#commands that give nothing here, ex: no thermal zone, are skipped
+
+import subprocess
+
+import pytest
+
+import local_system_information as LOCALSYSINFO
+import raspberry_pi_system_information_commands as RSYSINFO
+
+def run_shell(command):
+    result = subprocess.run(command, shell=True, capture_output=True)
+    return result.returncode, result.stdout.decode().strip()
+
+@pytest.mark.parametrize('name', [name for name in LOCALSYSINFO.COMMANDS.keys() if LOCALSYSINFO.TOLERANCES.get(name, 0) is not None])
+def test_matches_shell_command(name):
+    returncode, shell = run_shell(getattr(RSYSINFO, name))
+    if returncode != 0 or not shell:
+        pytest.skip(f'{name} is not available here')
+
+    local = LOCALSYSINFO.get_values([name])[name]
+    assert LOCALSYSINFO.matches(name, shell, local), f'shell [{shell}] local [{local}]'
@@ -29,6 +29,8 @@
 
 
 import logging
+import time
+from PIL import Image
 from . import epdconfig
 
 # Display resolution
@@ -37,14 +39,74 @@ EPD_HEIGHT      = 250
 
 logger = logging.getLogger(__name__)
 
+# marks a wait for the BUSY pin in a command sequence
+BUSY = None
+
+# longest to wait for the BUSY pin before giving up, a full refresh takes a few seconds
+DEFAULT_BUSY_TIMEOUT = 10
+
+def window_commands(x_start, y_start, x_end, y_end):
+    # x point must be the multiple of 8 or the last 3 bits will be ignored
+    return [
+        (0x44, [(x_start>>3) & 0xFF, (x_end>>3) & 0xFF]), # SET_RAM_X_ADDRESS_START_END_POSITION
+        (0x45, [y_start & 0xFF, (y_start >> 8) & 0xFF, y_end & 0xFF, (y_end >> 8) & 0xFF]), # SET_RAM_Y_ADDRESS_START_END_POSITION
+    ]
+
+def cursor_commands(x, y):
+    # x point must be the multiple of 8 or the last 3 bits will be ignored
+    return [
+        (0x4E, [(x>>3) & 0xFF]), # SET_RAM_X_ADDRESS_COUNTER
+        (0x4F, [y & 0xFF, (y >> 8) & 0xFF]), # SET_RAM_Y_ADDRESS_COUNTER
+    ]
+
+# (command, data) sequences for send_sequence, built once
+INIT_FAST_SEQUENCE = [
+    (0x12, []), # SWRESET
+    (BUSY, None),
+    (0x18, []), # Read built-in temperature sensor
+    (0x80, []), # sent as a command, as the original init_fast did
+    (0x11, [0x03]), # data entry mode
+    *window_commands(0, 0, EPD_WIDTH - 1, EPD_HEIGHT - 1),
+    *cursor_commands(0, 0),
+    (0x22, [0xB1]), # Load temperature value
+    (0x20, []),
+    (BUSY, None),
+    (0x1A, [0x64, 0x00]), # Write to temperature register
+    (0x22, [0x91]), # Load temperature value
+    (0x20, []),
+    (BUSY, None),
+]
+
+PARTIAL_SEQUENCE = [
+    (0x3C, [0x80]), # BorderWavefrom
+    (0x01, [0xF9, 0x00, 0x00]), # Driver output control
+    (0x11, [0x03]), # data entry mode
+]
+
+FULL_WINDOW_SEQUENCE = [
+    *window_commands(0, 0, EPD_WIDTH - 1, EPD_HEIGHT - 1),
+    *cursor_commands(0, 0),
+]
+
 class EPD:
-    def __init__(self):
+    def __init__(self, spi_speed_hz=None, busy_timeout=DEFAULT_BUSY_TIMEOUT):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
         self.busy_pin = epdconfig.BUSY_PIN
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+
+        if spi_speed_hz is not None:
+            epdconfig.set_spi_speed(spi_speed_hz)
+
+        # how long each kind of busy wait took last time, and in total, in seconds
+        self.busy_timeout = busy_timeout
+        self.busy_times = {}
+        self.busy_totals = {}
+
+        # reused for every frame, see getbuffer
+        self.buffer = bytearray(self.getlinewidth() * self.height)
         
     '''
     function :Hardware reset
@@ -86,46 +148,79 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
+
+    '''
+    function :send a command and all of its data in one transaction
+    parameter:
+     command : Command register
+     data : Data bytes
+    '''
+    def send_command_data(self, command, data):
+        # the DC pin has to change between the command and data, so they are two writes
+        epdconfig.digital_write(self.dc_pin, 0)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte([command])
+        if data:
+            epdconfig.digital_write(self.dc_pin, 1)
+            epdconfig.spi_writebyte2(data)
+        epdconfig.digital_write(self.cs_pin, 1)
+
+    '''
+    function :send a prebuilt list of (command, data), waiting where it says BUSY
+    parameter:
+     sequence : List of (command, data)
+    '''
+    def send_sequence(self, sequence, phase='sequence'):
+        for command, data in sequence:
+            if command is BUSY:
+                self.ReadBusy(phase)
+            else:
+                self.send_command_data(command, data)
     
     '''
     function :Wait until the busy_pin goes LOW
     parameter:
     '''
-    def ReadBusy(self):
+    def ReadBusy(self, phase='busy'):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
-            epdconfig.delay_ms(10)  
-        logger.debug("e-Paper busy release")
+        start = time.monotonic()
+        released = epdconfig.wait_busy_release(self.busy_timeout)
+        elapsed = time.monotonic() - start
+
+        # keep track of where refresh time goes
+        self.busy_times[phase] = elapsed
+        self.busy_totals[phase] = self.busy_totals.get(phase, 0) + elapsed
+
+        if not released:
+            raise TimeoutError(f"e-Paper still busy after {self.busy_timeout}s ({phase})")
+        logger.debug(f"e-Paper busy release after {elapsed:.3f}s ({phase})")
 
     '''
     function : Turn On Display
     parameter:
     '''
     def TurnOnDisplay(self):
-        self.send_command(0x22) # Display Update Control
-        self.send_data(0xf7)
-        self.send_command(0x20) # Activate Display Update Sequence
-        self.ReadBusy()
+        self.send_command_data(0x22, [0xf7]) # Display Update Control
+        self.send_command_data(0x20, []) # Activate Display Update Sequence
+        self.ReadBusy('full')
 
     '''
     function : Turn On Display Fast
     parameter:
     '''
     def TurnOnDisplay_Fast(self):
-        self.send_command(0x22) # Display Update Control
-        self.send_data(0xC7)    # fast:0x0c, quality:0x0f, 0xcf
-        self.send_command(0x20) # Activate Display Update Sequence
-        self.ReadBusy()
+        self.send_command_data(0x22, [0xC7]) # Display Update Control, fast:0x0c, quality:0x0f, 0xcf
+        self.send_command_data(0x20, []) # Activate Display Update Sequence
+        self.ReadBusy('fast')
     
     '''
     function : Turn On Display Part
     parameter:
     '''
     def TurnOnDisplayPart(self):
-        self.send_command(0x22) # Display Update Control
-        self.send_data(0xff)    # fast:0x0c, quality:0x0f, 0xcf
-        self.send_command(0x20) # Activate Display Update Sequence
-        self.ReadBusy()
+        self.send_command_data(0x22, [0xff]) # Display Update Control, fast:0x0c, quality:0x0f, 0xcf
+        self.send_command_data(0x20, []) # Activate Display Update Sequence
+        self.ReadBusy('partial')
 
 
     '''
@@ -137,16 +232,8 @@ class EPD:
         yend : End position of Y-axis
     '''
     def SetWindow(self, x_start, y_start, x_end, y_end):
-        self.send_command(0x44) # SET_RAM_X_ADDRESS_START_END_POSITION
-        # x point must be the multiple of 8 or the last 3 bits will be ignored
-        self.send_data((x_start>>3) & 0xFF)
-        self.send_data((x_end>>3) & 0xFF)
-        
-        self.send_command(0x45) # SET_RAM_Y_ADDRESS_START_END_POSITION
-        self.send_data(y_start & 0xFF)
-        self.send_data((y_start >> 8) & 0xFF)
-        self.send_data(y_end & 0xFF)
-        self.send_data((y_end >> 8) & 0xFF)
+        for command, data in window_commands(x_start, y_start, x_end, y_end):
+            self.send_command_data(command, data)
 
     '''
     function : Set Cursor
@@ -155,13 +242,8 @@ class EPD:
         y : Y-axis starting position
     '''
     def SetCursor(self, x, y):
-        self.send_command(0x4E) # SET_RAM_X_ADDRESS_COUNTER
-        # x point must be the multiple of 8 or the last 3 bits will be ignored
-        self.send_data(x & 0xFF)
-        
-        self.send_command(0x4F) # SET_RAM_Y_ADDRESS_COUNTER
-        self.send_data(y & 0xFF)
-        self.send_data((y >> 8) & 0xFF)
+        for command, data in cursor_commands(x, y):
+            self.send_command_data(command, data)
     
     '''
     function : Initialize the e-Paper register
@@ -173,9 +255,9 @@ class EPD:
         # EPD hardware init start
         self.reset()
         
-        self.ReadBusy()
+        self.ReadBusy('init')
         self.send_command(0x12)  #SWRESET
-        self.ReadBusy() 
+        self.ReadBusy('init') 
 
         self.send_command(0x01) #Driver output control      
         self.send_data(0xf9)
@@ -198,7 +280,7 @@ class EPD:
         self.send_command(0x18)
         self.send_data(0x80)
         
-        self.ReadBusy()
+        self.ReadBusy('init')
         
         return 0
 
@@ -210,35 +292,19 @@ class EPD:
         if (epdconfig.module_init() != 0):
             return -1
         # EPD hardware init start
-        self.reset()
-
-        self.send_command(0x12)  #SWRESET
-        self.ReadBusy() 
-
-        self.send_command(0x18) # Read built-in temperature sensor
-        self.send_command(0x80)
-
-        self.send_command(0x11) # data entry mode       
-        self.send_data(0x03)    
-
-        self.SetWindow(0, 0, self.width-1, self.height-1)
-        self.SetCursor(0, 0)
-        
-        self.send_command(0x22) # Load temperature value
-        self.send_data(0xB1)	
-        self.send_command(0x20)
-        self.ReadBusy()
-
-        self.send_command(0x1A) # Write to temperature register
-        self.send_data(0x64)
-        self.send_data(0x00)
-                        
-        self.send_command(0x22) # Load temperature value
-        self.send_data(0x91)	
-        self.send_command(0x20)
-        self.ReadBusy()
+        self.reinit_fast()
         
         return 0
+
+    '''
+    function : Initialize the e-Paper fast register again, without opening SPI and the GPIO again
+    parameter:
+    '''
+    def reinit_fast(self):
+        # for going back to a full refresh or recovering after init_fast, SPI is already open
+        self.reset()
+
+        self.send_sequence(INIT_FAST_SEQUENCE, 'init')
     '''
     function : Display images
     parameter:
@@ -247,7 +313,14 @@ class EPD:
     def getbuffer(self, image):
         img = image
         imwidth, imheight = img.size
-        if(imwidth == self.width and imheight == self.height):
+        if(img.mode == '1' and imwidth == self.height and imheight == self.width):
+            # fast path for landscape 1 bit images, the usual case
+            # transpose is a plain pixel copy with no resampling, and no conversion is needed
+            # the packed bits are copied into the same buffer every frame, so it's only valid until the next call,
+            # callers that keep a frame have to copy it, ex: epd_text keeps bytes(buffer) for partial updates
+            self.buffer[:] = img.transpose(Image.Transpose.ROTATE_90).tobytes('raw')
+            return self.buffer
+        elif(imwidth == self.width and imheight == self.height):
             img = img.convert('1')
         elif(imwidth == self.height and imheight == self.width):
             # image has correct dimensions, but needs to be rotated
@@ -289,24 +362,50 @@ class EPD:
         epdconfig.delay_ms(1)
         epdconfig.digital_write(self.reset_pin, 1)  
 
-        self.send_command(0x3C) # BorderWavefrom
-        self.send_data(0x80)
+        self.send_sequence(PARTIAL_SEQUENCE)
+        self.send_sequence(FULL_WINDOW_SEQUENCE)
+        
+        self.send_command_data(0x24, image) # WRITE_RAM
+        self.TurnOnDisplayPart()
 
-        self.send_command(0x01) # Driver output control      
-        self.send_data(0xF9) 
-        self.send_data(0x00)
-        self.send_data(0x00)
+    '''
+    function : Sends only some windows of the image buffer in RAM to e-Paper and partial refresh
+    parameter:
+        image : Image data, the full buffer from getbuffer
+        windows : List of (x_start, y_start, x_end, y_end), x_start and x_end + 1 must be multiples of 8
+    '''
+    def displayPartialWindows(self, image, windows):
+        epdconfig.digital_write(self.reset_pin, 0)
+        epdconfig.delay_ms(1)
+        epdconfig.digital_write(self.reset_pin, 1)
 
-        self.send_command(0x11) # data entry mode       
-        self.send_data(0x03)
+        self.send_sequence(PARTIAL_SEQUENCE)
 
-        self.SetWindow(0, 0, self.width - 1, self.height - 1)
-        self.SetCursor(0, 0)
-        
-        self.send_command(0x24) # WRITE_RAM
-        self.send_data2(image)  
+        linewidth = self.getlinewidth()
+        for x_start, y_start, x_end, y_end in windows:
+            self.SetWindow(x_start, y_start, x_end, y_end)
+            self.SetCursor(x_start, y_start)
+
+            # the RAM outside the window keeps what was sent last time
+            data = bytearray()
+            for y in range(y_start, y_end + 1):
+                data += image[y * linewidth + (x_start >> 3) : y * linewidth + (x_end >> 3) + 1]
+
+            self.send_command_data(0x24, data) # WRITE_RAM
         self.TurnOnDisplayPart()
 
+        # put the window back for full screen updates
+        self.send_sequence(FULL_WINDOW_SEQUENCE)
+
+    '''
+    function : Bytes per row of the image buffer
+    parameter:
+    '''
+    def getlinewidth(self):
+        if self.width%8 == 0:
+            return int(self.width/8)
+        return int(self.width/8) + 1
+
     '''
     function : Refresh a base image
     parameter:
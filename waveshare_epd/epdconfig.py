@@ -33,6 +33,11 @@ import sys
 import time
 import subprocess
 
+# longest single wait on the BUSY pin's release event before checking the pin again, in seconds
+BUSY_WAIT_SLICE = 0.1
+# how long to sleep when the release event is stale but the pin is still busy, in seconds
+BUSY_POLL_INTERVAL = 0.01
+
 from ctypes import *
 
 logger = logging.getLogger(__name__)
@@ -59,6 +64,11 @@ class RaspberryPi:
         self.GPIO_PWR_PIN    = gpiozero.LED(self.PWR_PIN)
         self.GPIO_BUSY_PIN   = gpiozero.Button(self.BUSY_PIN, pull_up = False)
 
+        self.spi_speed_hz = 4000000
+
+    def set_spi_speed(self, speed_hz):
+        # takes effect on the next module_init
+        self.spi_speed_hz = speed_hz
         
 
     def digital_write(self, pin, value):
@@ -98,6 +108,24 @@ class RaspberryPi:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_busy_release(self, timeout=None):
+        # waits for the BUSY pin to go low, returns False if it timed out
+        # gpiozero's release event is only cleared once its edge thread sees BUSY go high, which can be after
+        # the command that set it returns, so the pin itself decides, and the event is just used to sleep in slices
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.GPIO_BUSY_PIN.is_active:      # active: busy
+            wait = BUSY_WAIT_SLICE
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+
+            # the event can still be set from the last release, so don't spin on it
+            if self.GPIO_BUSY_PIN.wait_for_release(wait) and self.GPIO_BUSY_PIN.is_active:
+                time.sleep(min(BUSY_POLL_INTERVAL, wait))
+        return True
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
@@ -141,7 +169,7 @@ class RaspberryPi:
         else:
             # SPI device, bus = 0, device = 0
             self.SPI.open(0, 0)
-            self.SPI.max_speed_hz = 4000000
+            self.SPI.max_speed_hz = self.spi_speed_hz
             self.SPI.mode = 0b00
         return 0
 
@@ -192,6 +220,10 @@ class JetsonNano:
         import Jetson.GPIO
         self.GPIO = Jetson.GPIO
 
+    def set_spi_speed(self, speed_hz):
+        # software SPI, the speed can't be changed
+        logger.warning("SPI speed can't be set on Jetson Nano")
+
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
 
@@ -201,6 +233,15 @@ class JetsonNano:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_busy_release(self, timeout=None):
+        # polls the BUSY pin until it goes low, returns False if it timed out
+        start = time.monotonic()
+        while self.digital_read(self.BUSY_PIN) == 1:      # 0: idle, 1: busy
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return False
+            self.delay_ms(10)
+        return True
+
     def spi_writebyte(self, data):
         self.SPI.SYSFS_software_spi_transfer(data[0])
 
@@ -249,6 +290,11 @@ class SunriseX3:
 
         self.GPIO = Hobot.GPIO
         self.SPI = spidev.SpiDev()
+        self.spi_speed_hz = 4000000
+
+    def set_spi_speed(self, speed_hz):
+        # takes effect on the next module_init
+        self.spi_speed_hz = speed_hz
 
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
@@ -259,6 +305,15 @@ class SunriseX3:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_busy_release(self, timeout=None):
+        # polls the BUSY pin until it goes low, returns False if it timed out
+        start = time.monotonic()
+        while self.digital_read(self.BUSY_PIN) == 1:      # 0: idle, 1: busy
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return False
+            self.delay_ms(10)
+        return True
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
@@ -282,7 +337,7 @@ class SunriseX3:
         
             # SPI device, bus = 0, device = 0
             self.SPI.open(2, 0)
-            self.SPI.max_speed_hz = 4000000
+            self.SPI.max_speed_hz = self.spi_speed_hz
             self.SPI.mode = 0b00
             return 0
         else:
@@ -301,6 +356,167 @@ class SunriseX3:
         self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN], self.PWR_PIN)
 
 
+class Simulated:
+    # Pin definition, same as the Raspberry Pi
+    RST_PIN  = 17
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 18
+
+    # controller RAM, 8 pixels per byte across, for the 2.13 inch V4 panel
+    RAM_WIDTH  = 16
+    RAM_HEIGHT = 250
+    PANEL_WIDTH = 122
+
+    # how long the panel stays busy after 0x20 for each display update control (0x22) value, in seconds
+    BUSY_TIMES = {
+        0xF7: 2.0,  # full refresh
+        0xC7: 1.5,  # fast refresh
+        0xFF: 0.3,  # partial refresh
+        0xB1: 0.1,  # load temperature
+        0x91: 0.1,  # load temperature
+    }
+    SWRESET_BUSY_TIME = 0.01
+    REFRESH_MODES = (0xF7, 0xC7, 0xFF)
+
+    # runs without any hardware, decoding the command stream into frames
+    # EPD_SIMULATED_OUTPUT: folder to save each frame to as a PNG
+    # EPD_SIMULATED_TIME_SCALE: multiplier for all delays and busy times, 0 runs as fast as possible
+    def __init__(self):
+        self.output_dir = os.getenv('EPD_SIMULATED_OUTPUT')
+        self.time_scale = float(os.getenv('EPD_SIMULATED_TIME_SCALE', '1'))
+        self.spi_speed_hz = 4000000
+
+        self.dc = 0
+        self.busy_until = 0
+        self.spi_time = 0
+        self.command = None
+        self.data = []
+
+        self.ram = bytearray([0xFF] * (self.RAM_WIDTH * self.RAM_HEIGHT))
+        self.old_ram = bytearray(self.ram)
+        self.window = (0, self.RAM_WIDTH - 1, 0, self.RAM_HEIGHT - 1)
+        self.cursor = [0, 0]
+        self.update_control = 0xF7
+
+        # counters for benchmarks and tests
+        self.frame_count = 0
+        self.bytes_sent = 0
+        self.refresh_counts = {}
+        self.last_frame = None
+
+    def set_spi_speed(self, speed_hz):
+        self.spi_speed_hz = speed_hz
+
+    def digital_write(self, pin, value):
+        if pin == self.DC_PIN:
+            self.dc = value
+
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            return 1 if time.monotonic() < self.busy_until else 0
+        return 0
+
+    def delay_ms(self, delaytime):
+        if self.time_scale:
+            time.sleep(delaytime / 1000.0 * self.time_scale)
+
+    def wait_busy_release(self, timeout=None):
+        remaining = self.busy_until - time.monotonic()
+        if timeout is not None and remaining > timeout:
+            time.sleep(timeout)
+            return False
+        if remaining > 0:
+            time.sleep(remaining)
+        return True
+
+    def spi_writebyte(self, data):
+        self.spi_writebyte2(data)
+
+    def spi_writebyte2(self, data):
+        self.bytes_sent += len(data)
+        for byte in data:
+            if self.dc:
+                self.__data(byte)
+            else:
+                self.__command(byte)
+
+        # model the transfer time at the SPI clock speed, sleeping in chunks since tiny sleeps are inaccurate
+        self.spi_time += len(data) * 8 / self.spi_speed_hz * self.time_scale
+        if self.spi_time >= 0.001:
+            time.sleep(self.spi_time)
+            self.spi_time = 0
+
+    def __busy(self, seconds):
+        self.busy_until = time.monotonic() + seconds * self.time_scale
+
+    def __command(self, command):
+        self.command = command
+        self.data = []
+
+        if command == 0x12: # SWRESET
+            self.window = (0, self.RAM_WIDTH - 1, 0, self.RAM_HEIGHT - 1)
+            self.cursor = [0, 0]
+            self.__busy(self.SWRESET_BUSY_TIME)
+        elif command == 0x20: # Activate Display Update Sequence
+            self.__busy(self.BUSY_TIMES.get(self.update_control, 0))
+            if self.update_control in self.REFRESH_MODES:
+                self.__showFrame()
+
+    def __data(self, byte):
+        if self.command in (0x24, 0x26): # WRITE_RAM, black/white and previous image
+            ram = self.ram if self.command == 0x24 else self.old_ram
+            x, y = self.cursor
+            if 0 <= x < self.RAM_WIDTH and 0 <= y < self.RAM_HEIGHT:
+                ram[y * self.RAM_WIDTH + x] = byte
+
+            # data entry mode 0x03, x then y increment within the window
+            x_start, x_end, y_start, y_end = self.window
+            x += 1
+            if x > x_end:
+                x = x_start
+                y = y + 1 if y < y_end else y_start
+            self.cursor = [x, y]
+            return
+
+        self.data.append(byte)
+        data = self.data
+        if self.command == 0x44 and len(data) == 2: # SET_RAM_X_ADDRESS_START_END_POSITION
+            self.window = (data[0], data[1], self.window[2], self.window[3])
+        elif self.command == 0x45 and len(data) == 4: # SET_RAM_Y_ADDRESS_START_END_POSITION
+            self.window = (self.window[0], self.window[1], data[0] | (data[1] << 8), data[2] | (data[3] << 8))
+        elif self.command == 0x4E and len(data) == 1: # SET_RAM_X_ADDRESS_COUNTER
+            self.cursor[0] = data[0]
+        elif self.command == 0x4F and len(data) == 2: # SET_RAM_Y_ADDRESS_COUNTER
+            self.cursor[1] = data[0] | (data[1] << 8)
+        elif self.command == 0x22 and len(data) == 1: # Display Update Control
+            self.update_control = data[0]
+
+    def __showFrame(self):
+        from PIL import Image
+
+        self.frame_count += 1
+        self.refresh_counts[self.update_control] = self.refresh_counts.get(self.update_control, 0) + 1
+        self.old_ram[:] = self.ram
+
+        # RAM is in panel orientation, turn it back to how it was drawn
+        image = Image.frombytes('1', (self.RAM_WIDTH * 8, self.RAM_HEIGHT), bytes(self.ram))
+        self.last_frame = image.crop((0, 0, self.PANEL_WIDTH, self.RAM_HEIGHT)).transpose(Image.Transpose.ROTATE_270)
+
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f'frame_{self.frame_count:05d}.png')
+            self.last_frame.save(path)
+            logger.debug(f"Saved simulated frame {path}")
+
+    def module_init(self, cleanup=False):
+        return 0
+
+    def module_exit(self, cleanup=False):
+        logger.debug("simulated module exit")
+
+
 # if sys.version_info[0] == 2:
 #     process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE)
 # else:
@@ -319,7 +535,11 @@ class SunriseX3:
 #finiteui - 2025-08-25
 #the check above causes issues when running on docker, since it doesn't recognize it as a raspberry pi
 #small edit to force it to initialize as a raspberry pi
-implementation = RaspberryPi()
+#EPD_BACKEND=simulated runs a virtual panel instead, for running and benchmarking without the hardware
+if os.getenv('EPD_BACKEND', '').lower() == 'simulated':
+    implementation = Simulated()
+else:
+    implementation = RaspberryPi()
 
 for func in [x for x in dir(implementation) if not x.startswith('_')]:
     setattr(sys.modules[__name__], func, getattr(implementation, func))